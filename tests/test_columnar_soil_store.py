@@ -0,0 +1,134 @@
+import sqlite3
+
+import numpy as np
+import pytest
+from pyproj import CRS, Transformer
+
+from zalfmas_services.soil import sqlite_soil_data_service as sss
+
+COLUMNS = [
+    "polygon_id",
+    "profile_id_in_polygon",
+    "range_percentage_of_area",
+    "avg_range_percentage_of_area",
+    "layer_depth",
+    "soil_organic_carbon",
+    "soil_organic_matter",
+    "bulk_density",
+    "raw_density",
+    "sand",
+    "clay",
+    "silt",
+    "ph",
+    "KA5_texture_class",
+    "permanent_wilting_point",
+    "field_capacity",
+    "saturation",
+    "soil_water_conductivity_coefficient",
+    "sceleton",
+    "soil_ammonium",
+    "soil_nitrate",
+    "c_n",
+    "initial_soil_moisture",
+    "layer_description",
+    "is_in_groundwater",
+    "is_impenetrable",
+]
+
+NO_OF_SOIL_IDS = 5
+# in the grid, but not in the database
+MISSING_SOIL_ID = 99
+
+
+@pytest.fixture
+def soil_db_and_grid(tmp_path):
+    rng = np.random.default_rng(1)
+    path_to_db = str(tmp_path / "soil.sqlite")
+    con = sqlite3.connect(path_to_db)
+    con.execute(f"create table soil_profile_all ({', '.join(COLUMNS)})")
+    insert = f"insert into soil_profile_all values ({','.join('?' * len(COLUMNS))})"
+    for soil_id in range(1, NO_OF_SOIL_IDS + 1):
+        for profile_id in range(1, int(rng.integers(1, 4)) + 1):
+            depth = 0.0
+            for layer in range(int(rng.integers(2, 5))):
+                depth = round(depth + 0.1 * int(rng.integers(1, 5)), 1)
+                sand = float(rng.integers(5, 80))
+                clay = float(rng.integers(5, 20))
+                row = {
+                    "polygon_id": soil_id,
+                    "profile_id_in_polygon": profile_id,
+                    "range_percentage_of_area": "10-30",
+                    "avg_range_percentage_of_area": float(rng.integers(5, 60)),
+                    "layer_depth": depth,
+                    "soil_organic_carbon": float(rng.random() * 3),
+                    "bulk_density": float(1200 + rng.integers(0, 500)),
+                    "raw_density": float(1500 + rng.integers(0, 300)),
+                    "sand": sand,
+                    "clay": clay,
+                    "silt": 100 - sand - clay,
+                    "ph": float(5 + rng.random() * 3),
+                    "KA5_texture_class": None if layer % 2 else "Ls2",
+                    "sceleton": float(rng.integers(0, 20)),
+                    "layer_description": f"layer {layer}",
+                    "is_in_groundwater": int(rng.integers(0, 2)),
+                    "is_impenetrable": 0,
+                }
+                con.execute(insert, [row.get(c) for c in COLUMNS])
+    con.commit()
+    con.close()
+
+    path_to_grid = str(tmp_path / "soil_1000_25832.asc")
+    with open(path_to_grid, "w") as _:
+        _.write(
+            "ncols 3\nnrows 2\nxllcorner 400000\nyllcorner 5700000\ncellsize 1000\n"
+            "NODATA_value -9999\n"
+        )
+        _.write(f"1 2 3\n4 5 {MISSING_SOIL_ID}\n")
+    return path_to_db, path_to_grid
+
+
+def dump(profile_datas):
+    return [
+        (
+            id,
+            data.percentageOfArea,
+            [
+                (layer.size, [str(prop) for prop in layer.properties])
+                for layer in data.layers
+            ],
+        )
+        for id, data in profile_datas
+    ]
+
+
+@pytest.mark.parametrize("only_raw_data", [True, False])
+def test_columnar_store_matches_database(soil_db_and_grid, only_raw_data):
+    path_to_db, path_to_grid = soil_db_and_grid
+    crs = CRS.from_epsg(25832)
+    db_service = sss.Service(path_to_db, path_to_grid, crs)
+    columnar_service = sss.Service(path_to_db, path_to_grid, crs, columnar_store=True)
+    avail_props = db_service.available_properties(
+        ["sand", "clay"], ["organicCarbon", "soilType", "pH"], only_raw_data
+    )
+    assert len(avail_props) > 0
+
+    for soil_id in [*range(1, NO_OF_SOIL_IDS + 1), MISSING_SOIL_ID]:
+        assert columnar_service.soil_profile_group(
+            soil_id, only_raw_data
+        ) == db_service.soil_profile_group(soil_id, only_raw_data)
+        assert dump(
+            columnar_service.profile_datas(soil_id, avail_props, only_raw_data)
+        ) == dump(db_service.profile_datas(soil_id, avail_props, only_raw_data))
+
+    assert columnar_service.soil_profile_group(MISSING_SOIL_ID, only_raw_data) == (
+        MISSING_SOIL_ID,
+        [],
+    )
+
+    # the center of the grid cell with the missing soil id
+    lon, lat = Transformer.from_crs(crs, CRS.from_epsg(4326), always_xy=True).transform(
+        402500, 5700500
+    )
+    for service in (db_service, columnar_service):
+        assert service.soil_id_at(lat, lon) == MISSING_SOIL_ID
+        assert service.profiles_at(lat, lon, avail_props, only_raw_data) == []
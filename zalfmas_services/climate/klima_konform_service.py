@@ -19,12 +19,16 @@ import asyncio
 import capnp
 from datetime import date, timedelta
 from netCDF4 import Dataset
+import numpy as np
 import os
 from pathlib import Path
 from pyproj import Transformer
 from scipy.interpolate import NearestNDInterpolator
 import sys
 
+from zalfmas_services import lru_cache
+from zalfmas_services.climate.time_series_data import TimeSeriesData
+
 # remote debugging via commandline
 # -m ptvsd --host 0.0.0.0 --port 14000 --wait
 
@@ -52,14 +56,11 @@ climate_data_capnp = capnp.load(
 
 class TimeSeries(climate_data_capnp.TimeSeries.Server):
     def __init__(self, data_t, header, metadata=None, location=None):
-        self._data_t = data_t
-        self._data = None
-        self._header = header
+        self._data = TimeSeriesData(data_t, header)
         self._meta = metadata
         self._location = location
-        no_of_days = len(data_t[0]) if len(data_t) > 0 else 0
         self._start_date = date(1961, 1, 1)
-        self._end_date = date(1961, 1, 1) + timedelta(days=no_of_days - 1)
+        self._end_date = date(1961, 1, 1) + timedelta(days=self._data.no_of_days - 1)
 
     def resolution_context(self, context):  # -> (resolution :TimeResolution);
         context.results.resolution = climate_data_capnp.TimeSeries.Resolution.daily
@@ -69,18 +70,13 @@ class TimeSeries(climate_data_capnp.TimeSeries.Server):
         context.results.endDate = ccdi.create_capnp_date(self._end_date)
 
     def header(self, **kwargs):  # () -> (header :List(Element));
-        return self._header
+        return self._data.header
 
     def data(self, **kwargs):  # () -> (data :List(List(Float32)));
-        if self._data is None:
-            no_of_days = len(self._data_t[0]) if len(self._data_t) > 0 else 0
-            self._data = list(
-                [list(map(lambda ds: ds[i], self._data_t)) for i in range(no_of_days)]
-            )
-        return self._data
+        return self._data.data()
 
     def dataT(self, **kwargs):  # () -> (data :List(List(Float32)));
-        return self._data_t
+        return self._data.data_t()
 
     def subrange_context(
         self, context
@@ -89,21 +85,23 @@ class TimeSeries(climate_data_capnp.TimeSeries.Server):
         to_date = ccdi.create_date(context.params.to)
         start_i = (from_date - self._start_date).days
         end_i = (to_date - self._start_date).days
-        sub_data_t = [ds[start_i : end_i + 1] for ds in self._data_t]
+        sub_data = self._data.subrange(start_i, end_i)
         context.results.timeSeries = TimeSeries(
-            sub_data_t, self._header, metadata=self._meta, location=self._location
+            sub_data.array,
+            sub_data.header,
+            metadata=self._meta,
+            location=self._location,
         )
 
     def subheader(
         self, elements, **kwargs
     ):  # (elements :List(Element)) -> (timeSeries :TimeSeries);
-        sub_header = [str(e) for e in elements]
-        sub_data_t = []
-        for i, elem in enumerate(self._header):
-            if elem in sub_header:
-                sub_data_t.append(self._data_t[i])
+        sub_data = self._data.subheader([str(e) for e in elements])
         return TimeSeries(
-            sub_data_t, sub_header, metadata=self._meta, location=self._location
+            sub_data.array,
+            sub_data.header,
+            metadata=self._meta,
+            location=self._location,
         )
 
     def metadata(self, _context, **kwargs):  # metadata @7 () -> Metadata;
@@ -126,7 +124,14 @@ class TimeSeries(climate_data_capnp.TimeSeries.Server):
 
 
 class DatasetImpl(climate_data_capnp.Dataset.Server):
-    def __init__(self, path_to_nc_files, region="sn", metadata=None):
+    def __init__(
+        self,
+        path_to_nc_files,
+        region="sn",
+        metadata=None,
+        rows_per_block=0,
+        slab_cache_max_bytes=512 * 1024 * 1024,
+    ):
         self._elem_to_data = {}
         if region == "sn":
             self._elem_to_data = {
@@ -283,6 +288,32 @@ class DatasetImpl(climate_data_capnp.Dataset.Server):
         )
         self._interpolator = self.create_interpolator()
 
+        # if rows_per_block > 0, the time series are read in slabs of rows_per_block
+        # rows (all days and cols) per variable, which are kept in an LRU cache,
+        # else every time series is read cell by cell
+        self._rows_per_block = rows_per_block
+        self._slabs = None
+        if rows_per_block > 0 and len(self._elem_to_data) > 0:
+            # the float32 slabs of one row block of all elements
+            block_bytes = 0
+            for data in self._elem_to_data.values():
+                days, rows, cols = data["ds"][data["var"]].shape
+                block_bytes += days * min(rows_per_block, rows) * cols * 4
+            max_blocks = slab_cache_max_bytes // block_bytes
+            if max_blocks == 0:
+                print(
+                    f"One row block of all elements ({block_bytes} bytes) doesn't fit",
+                    f"into the slab cache ({slab_cache_max_bytes} bytes),",
+                    "reading the time series cell by cell instead.",
+                )
+                self._rows_per_block = 0
+            else:
+                self._slabs = lru_cache.LRUCache(
+                    max_blocks * len(self._elem_to_data),
+                    slab_cache_max_bytes,
+                    sizeof=lambda a: a.nbytes,
+                )
+
     def metadata(self, _context, **kwargs):  # metadata @0 () -> Metadata;
         # get metadata for these data
         r = _context.results
@@ -322,16 +353,40 @@ class DatasetImpl(climate_data_capnp.Dataset.Server):
 
         return NearestNDInterpolator(gk4_coords, row_cols)
 
-    def time_series_at(self, row, col, location=None):
-        if (row, col) not in self._time_series:
-            data_t = list(
+    def slab(self, elem, top):
+        """the converted float32 (days, rows, cols) slab of elem starting at row top"""
+        slab = self._slabs.get((elem, top))
+        if slab is None:
+            data = self._elem_to_data[elem]
+            var = data["ds"][data["var"]]
+            slab = (
+                np.ma.filled(var[:, top : top + self._rows_per_block, :], 0.0)
+                * np.float64(data["convf"])
+            ).astype(np.float32)
+            self._slabs.put((elem, top), slab)
+        return slab
+
+    def read_data_t(self, row, col):
+        """read the data of all elements at row/col as float32 (elements, days) array,
+        in row-block mode via the slabs"""
+        if self._rows_per_block <= 0:
+            return np.array(
                 [
-                    list(
-                        map(float, data["ds"][data["var"]][:, row, col] * data["convf"])
+                    np.ma.filled(
+                        data["ds"][data["var"]][:, row, col] * data["convf"], 0.0
                     )
                     for data in self._elem_to_data.values()
-                ]
+                ],
+                dtype=np.float32,
             )
+        top = row - row % self._rows_per_block
+        return np.stack(
+            [self.slab(elem, top)[:, row - top, col] for elem in self._elem_to_data]
+        )
+
+    def time_series_at(self, row, col, location=None):
+        if (row, col) not in self._time_series:
+            data_t = self.read_data_t(row, col)
 
             if not location:
                 location = self.location_at(row, col)
@@ -413,6 +468,8 @@ async def async_main(
     id=None,
     name="Klima Konform",
     description=None,
+    rows_per_block=0,
+    slab_cache_max_bytes=512 * 1024 * 1024,
 ):
     config = {
         "path_to_nc_files": path_to_nc_files,
@@ -425,6 +482,8 @@ async def async_main(
         "reg_sturdy_ref": reg_sturdy_ref,
         "serve_bootstrap": str(serve_bootstrap),
         "reg_category": "climate",
+        "rows_per_block": str(rows_per_block),
+        "slab_cache_max_bytes": str(slab_cache_max_bytes),
     }
     # read commandline args only if script is invoked directly from commandline
     if len(sys.argv) > 1 and __name__ == "__main__":
@@ -438,7 +497,12 @@ async def async_main(
 
     # interpolator, rowcol_to_latlon = ccdi.create_lat_lon_interpolator_from_json_coords_file(config["path_to_data"] + "/" + "latlon-to-rowcol.json")
     # meta_plus_data = create_meta_plus_datasets(config["path_to_data"], interpolator, rowcol_to_latlon)
-    service = DatasetImpl(path_to_nc_files, config["region"])
+    service = DatasetImpl(
+        path_to_nc_files,
+        config["region"],
+        rows_per_block=int(config["rows_per_block"]),
+        slab_cache_max_bytes=int(config["slab_cache_max_bytes"]),
+    )
 
     if config["reg_sturdy_ref"]:
         registrator = await conMan.try_connect(
@@ -39,6 +39,8 @@ from pkgs.common import common
 from pkgs.climate import common_climate_data_capnp_impl as ccdi
 from pkgs.common import service as serv
 
+from zalfmas_services.climate.time_series_data import TimeSeriesData
+
 PATH_TO_CAPNP_SCHEMAS = PATH_TO_REPO / "capnproto_schemas"
 abs_imports = [str(PATH_TO_CAPNP_SCHEMAS)]
 reg_capnp = capnp.load(
@@ -51,50 +53,25 @@ climate_data_capnp = capnp.load(
 
 class MultiTimeSeries(climate_data_capnp.TimeSeries.Server):
     def __init__(self, data_t, header, start_date, metadata=None, location=None):
-        self._data_t = data_t
-        self._data = None
-        self._header = header
+        self._data = TimeSeriesData(data_t, header)
         self._meta = metadata
         self._location = location
-        no_of_days = len(data_t[0]) if len(data_t) > 0 else 0
         self._start_date = start_date
-        self._end_date = start_date + timedelta(days=no_of_days - 1)
+        self._end_date = start_date + timedelta(days=self._data.no_of_days - 1)
 
     def append_data(self, data_t, start_date):
-        no_of_days = len(data_t[0]) if len(data_t) > 0 else 0
-        end_date = start_date + timedelta(days=no_of_days - 1)
-        new_data_t = []
-        if start_date <= self._end_date:
-            td = (self._end_date - start_date) + timedelta(days=1)
-            for ds, ds_ in zip(self._data_t, data_t):
-                nds = list(ds[: -td.days])
-                nds.extend(ds_)
-                new_data_t.append(nds)
-        elif start_date == self._end_date + timedelta(days=1):
-            for ds, ds_ in zip(self._data_t, data_t):
-                nds = list(ds)
-                nds.extend(ds_)
-                new_data_t.append(nds)
-        elif end_date >= self._start_date:
-            td = (end_date - self.start_date) + timedelta(days=1)
-            for ds, ds_ in zip(self._data_t, data_t):
-                nds = list(ds_)
-                nds.extend(ds[td.days :])
-                new_data_t.append(nds)
-        elif end_date == self._start_date - timedelta(days=1):
-            for ds, ds_ in zip(self._data_t, data_t):
-                nds = list(ds_)
-                nds.extend(ds)
-                new_data_t.append(nds)
-        else:
+        """Add the data starting at start_date, before or after the current data.
+        Overlapped days are replaced, the time series must not get gaps."""
+        try:
+            self._data, start_i = self._data.joined(
+                data_t, (start_date - self._start_date).days
+            )
+        except ValueError:
             raise Exception(
                 "MultiTimeSeries.append_data would produce gaps in time-series"
             )
-
-        self._data_t = new_data_t
-        no_of_days = len(self._data_t[0]) if len(self._data_t) > 0 else 0
-        self._end_date = self._start_date + timedelta(days=no_of_days - 1)
-        self._data = None
+        self._start_date += timedelta(days=start_i)
+        self._end_date = self._start_date + timedelta(days=self._data.no_of_days - 1)
 
     def resolution_context(self, context):  # -> (resolution :TimeResolution);
         context.results.resolution = climate_data_capnp.TimeSeries.Resolution.daily
@@ -104,18 +81,13 @@ class MultiTimeSeries(climate_data_capnp.TimeSeries.Server):
         context.results.endDate = ccdi.create_capnp_date(self._end_date)
 
     def header(self, **kwargs):  # () -> (header :List(Element));
-        return self._header
+        return self._data.header
 
     def data(self, **kwargs):  # () -> (data :List(List(Float32)));
-        if self._data is None:
-            no_of_days = len(self._data_t[0]) if len(self._data_t) > 0 else 0
-            self._data = list(
-                [list(map(lambda ds: ds[i], self._data_t)) for i in range(no_of_days)]
-            )
-        return self._data
+        return self._data.data()
 
     def dataT(self, **kwargs):  # () -> (data :List(List(Float32)));
-        return self._data_t
+        return self._data.data_t()
 
     def subrange_context(
         self, context
@@ -124,10 +96,10 @@ class MultiTimeSeries(climate_data_capnp.TimeSeries.Server):
         to_date = ccdi.create_date(context.params.to)
         start_i = (from_date - self._start_date).days
         end_i = (to_date - self._start_date).days
-        sub_data_t = [ds[start_i : end_i + 1] for ds in self._data_t]
+        sub_data = self._data.subrange(start_i, end_i)
         context.results.timeSeries = MultiTimeSeries(
-            sub_data_t,
-            self._header,
+            sub_data.array,
+            sub_data.header,
             from_date,
             metadata=self._meta,
             location=self._location,
@@ -136,14 +108,10 @@ class MultiTimeSeries(climate_data_capnp.TimeSeries.Server):
     def subheader(
         self, elements, **kwargs
     ):  # (elements :List(Element)) -> (timeSeries :TimeSeries);
-        sub_header = [str(e) for e in elements]
-        sub_data_t = []
-        for i, elem in enumerate(self._header):
-            if elem in sub_header:
-                sub_data_t.append(self._data_t[i])
+        sub_data = self._data.subheader([str(e) for e in elements])
         return MultiTimeSeries(
-            sub_data_t,
-            sub_header,
+            sub_data.array,
+            sub_data.header,
             self._start_date,
             metadata=self._meta,
             location=self._location,
@@ -396,16 +364,14 @@ class Dataset(climate_data_capnp.Dataset.Server):
                 return int(abs((ll0r["lat_0"] - lat) / ll0r["lat_res"]))
 
             def create_data_t(elem_to_data, row, col):
-                return list(
+                return np.array(
                     [
-                        list(
-                            map(
-                                lambda v: float(data["convf"](v)),
-                                data["ds"][data["var"]][:, row, col].compressed(),
-                            )
+                        np.ma.filled(
+                            data["convf"](data["ds"][data["var"]][:, row, col]), 0.0
                         )
                         for data in elem_to_data.values()
-                    ]
+                    ],
+                    dtype=np.float32,
                 )
 
             time_series = None
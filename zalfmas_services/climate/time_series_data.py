@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg-mohnicke@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+
+
+class TimeSeriesData:
+    """The data of a daily time series held as one contiguous float32 (elements, days)
+    array, together with the header (the element of every row).
+    Sub ranges and contiguous sub headers are views on the array, so they share its
+    memory. The lists for capnp messages are created from the array on request."""
+
+    def __init__(self, data_t, header):
+        """data_t is anything convertible to a (elements, days) float32 array,
+        an array of that kind is used as is without copying"""
+        self._header = list(header)
+        self._data_t = np.asarray(data_t, dtype=np.float32)
+        if self._data_t.size == 0:
+            self._data_t = np.zeros((len(self._header), 0), dtype=np.float32)
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def array(self):
+        """the (elements, days) float32 array"""
+        return self._data_t
+
+    @property
+    def no_of_days(self):
+        return self._data_t.shape[1]
+
+    def data(self):
+        """the values as list of days with a list of the element values each"""
+        return self._data_t.T.tolist()
+
+    def data_t(self):
+        """the values as list of elements with a list of the daily values each"""
+        return self._data_t.tolist()
+
+    def subrange(self, start_i, end_i):
+        """the days start_i to end_i (inclusive) as view on this data"""
+        return TimeSeriesData(self._data_t[:, start_i : end_i + 1], self._header)
+
+    def subheader(self, elements):
+        """The rows of the given elements in the order of this header. If the selected
+        rows are consecutive, the result is a view on this data, else a copy of them."""
+        rows = [i for i, elem in enumerate(self._header) if elem in elements]
+        header = [self._header[i] for i in rows]
+        if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1:
+            return TimeSeriesData(self._data_t[rows[0] : rows[-1] + 1], header)
+        return TimeSeriesData(self._data_t[rows], header)
+
+    def joined(self, other, start_i):
+        """Return the data with the days of other (same elements) placed at day start_i
+        (relative to the start of this data, might be negative). Days of this data
+        overlapped by other are replaced, the result has to be without gaps.
+        Returns the new data and its start day relative to this data."""
+        other_t = np.asarray(other, dtype=np.float32)
+        end_i = start_i + other_t.shape[1]
+        if start_i > self.no_of_days or end_i < 0:
+            raise ValueError("joining the time series would produce gaps")
+        parts = [self._data_t[:, : max(start_i, 0)], other_t]
+        parts.append(self._data_t[:, max(end_i, 0) :])
+        joined = TimeSeriesData(np.concatenate(parts, axis=1), self._header)
+        return joined, min(start_i, 0)
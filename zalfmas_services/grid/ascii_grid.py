@@ -14,16 +14,62 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import asyncio
-import math
 import uuid
 
 import capnp
+import numpy as np
 from pyproj import CRS, Transformer
 from zalfmas_capnp_schemas_with_stubs import grid_capnp
 from zalfmas_common import common, geo
-from zalfmas_common import rect_ascii_grid_management as grid_man
 from zalfmas_common import service as serv
 
+from zalfmas_services import lru_cache
+from zalfmas_services.grid import grid_cache, grid_index, grid_pyramid
+
+
+def weighted_median(values, weights):
+    """calc weighted median https://www.datablick.com/blog/2017/7/3/weighted-medians-for-weighted-data-in-tableau"""
+    order = np.argsort(values, kind="stable")
+    running_fractions = np.cumsum(weights[order])
+    running_fractions /= running_fractions[-1]
+    i = int(np.searchsorted(running_fractions, 0.5))
+    if running_fractions[i] == 0.5:
+        # it should be impossible to have no i+1 if == 0.5
+        return (values[order[i]] + values[order[i + 1]]) / 2.0
+    return values[order[i]]
+
+
+def aggregate(agg, values, weights):
+    """Aggregate the valid values of a window according to agg.
+    values and weights are 1D arrays of the window cell values and their area fractions.
+    The interpolated aggregations (iAvg, iMedian ...) expect the already interpolated values.
+    Returns None if there is nothing to aggregate."""
+    if len(values) == 0:
+        return None
+
+    if agg in ("avg", "iAvg"):
+        return np.mean(values)
+    elif agg == "wAvg":
+        # calc weighted average https://www.indeed.com/career-advice/career-development/how-to-calculate-weighted-average
+        return np.sum(values * weights) / np.sum(weights)
+    elif agg in ("median", "iMedian"):
+        return np.median(values)
+    elif agg == "wMedian":
+        return weighted_median(values * weights, weights)
+    elif agg in ("min", "iMin"):
+        return np.min(values)
+    elif agg == "wMin":
+        return np.min(values * weights)
+    elif agg in ("max", "iMax"):
+        return np.max(values)
+    elif agg == "wMax":
+        return np.max(values * weights)
+    elif agg in ("sum", "iSum"):
+        return np.sum(values)
+    elif agg == "wSum":
+        return np.sum(values * weights)
+    return None
+
 
 class RectMeterGrid(
     grid_capnp.Grid.Server,
@@ -41,6 +87,15 @@ class RectMeterGrid(
         description=None,
         admin=None,
         restorer=None,
+        grid=None,
+        metadata=None,
+        pyramid_levels=0,
+        result_cache_size=0,
+        result_cache_max_bytes=64 * 1024 * 1024,
+        summed_area_tables=False,
+        index=None,
+        latlon_to_grid_crs=None,
+        grid_crs_to_latlon=None,
     ):
         common.Identifiable.__init__(self, id, name, description)
         common.Persistable.__init__(self, restorer)
@@ -53,34 +108,33 @@ class RectMeterGrid(
         self._path = path_to_ascii_grid
         self._grid_crs = grid_crs
         self._wgs84 = geo.name_to_crs("latlon")
-        self._grid_crs_to_latlon = Transformer.from_crs(
-            grid_crs, self._wgs84, always_xy=True
+        # the transformers and the index might be shared, e.g. by the layers of a stack
+        self._grid_crs_to_latlon = (
+            grid_crs_to_latlon
+            if grid_crs_to_latlon is not None
+            else Transformer.from_crs(grid_crs, self._wgs84, always_xy=True)
         )
-        self._latlon_to_grid_crs = Transformer.from_crs(
-            self._wgs84, grid_crs, always_xy=True
+        self._latlon_to_grid_crs = (
+            latlon_to_grid_crs
+            if latlon_to_grid_crs is not None
+            else Transformer.from_crs(self._wgs84, grid_crs, always_xy=True)
         )
         self._val_type = val_type
 
-        self._grid, self._metadata = grid_man.load_grid_and_metadata_from_ascii_grid(
-            path_to_ascii_grid, datatype=val_type
-        )
-        self._include_nodata_rowcol_interpol, _ = (
-            grid_man.create_interpolator_from_rect_grid(
-                self._grid,
-                self._metadata,
-                ignore_nodata=False,
-                row_col_value=True,
-                no_points_to_values=True,
-            )
-        )
-        self._ignore_nodata_rowcol_interpol, _ = (
-            grid_man.create_interpolator_from_rect_grid(
-                self._grid,
-                self._metadata,
-                ignore_nodata=True,
-                row_col_value=True,
-                no_points_to_values=True,
+        if grid is not None and metadata is not None:
+            # an already loaded grid (e.g. a layer of a grid stack)
+            self._grid, self._metadata = grid, metadata
+        else:
+            # memory mapped from the binary sidecar of the ascii grid, if possible
+            self._grid, self._metadata = (
+                grid_cache.load_grid_and_metadata_from_ascii_grid(
+                    path_to_ascii_grid, datatype=val_type
+                )
             )
+        self._index = (
+            index
+            if index is not None
+            else grid_index.RectGridIndex(self._grid, self._metadata)
         )
         self._cellsize = int(self._metadata["cellsize"])
         self._nrows = int(self._metadata["nrows"])
@@ -93,6 +147,45 @@ class RectMeterGrid(
         self._xll = int(self._metadata["xllcorner"])
         self._yll = int(self._metadata["yllcorner"])
 
+        # optional summed area tables (with a leading row and col of zeros) of the valid
+        # values and the number of valid cells for constant time window sums and
+        # averages, they are private to the process and about twice the grid's size
+        self._sum_table = None
+        self._count_table = None
+        if summed_area_tables:
+            valid = self._grid != self._nodata
+            self._sum_table = np.zeros(
+                (self._nrows + 1, self._ncols + 1),
+                dtype=(np.int64 if self._grid.dtype.kind in "iu" else np.float64),
+            )
+            np.cumsum(
+                np.cumsum(np.where(valid, self._grid, 0), axis=0),
+                axis=1,
+                out=self._sum_table[1:, 1:],
+            )
+            self._count_table = np.zeros(
+                (self._nrows + 1, self._ncols + 1),
+                dtype=(np.int32 if self._nrows * self._ncols < 2**31 else np.int64),
+            )
+            np.cumsum(
+                np.cumsum(valid, axis=0, dtype=self._count_table.dtype),
+                axis=1,
+                out=self._count_table[1:, 1:],
+            )
+
+        # optional coarsened levels for min/max aggregations over large windows
+        self._pyramid = (
+            grid_pyramid.GridPyramid(self._grid, self._nodata, pyramid_levels)
+            if pyramid_levels > 0
+            else None
+        )
+
+        # aggregation results by (row, col, resolution, agg, ignoreNoData), results with
+        # aggregation parts are never cached, as they grow with the window
+        self._result_cache = lru_cache.LRUCache(
+            result_cache_size, result_cache_max_bytes, sizeof=lru_cache.deep_sizeof
+        )
+
     def to_union(self, value):
         if value == self._nodata:
             val = {"no": True}
@@ -120,10 +213,8 @@ class RectMeterGrid(
         )
 
         r, h = self._latlon_to_grid_crs.transform(lon, lat)
-        if ignoreNoData:
-            row, col, value = self._ignore_nodata_rowcol_interpol(r, h)
-        else:
-            row, col, value = self._include_nodata_rowcol_interpol(r, h)
+        row, col = self._index.row_col_at(r, h, ignore_nodata=ignoreNoData)
+        value = self._grid[row, col]
 
         if resolution_ <= self._cellsize:
             val = self.to_union(value)
@@ -131,8 +222,8 @@ class RectMeterGrid(
             return (val, rc, rc) if returnRowCols else val
 
         elif resolution_ % self._cellsize == 0:
-            union_value, aggValues, tl, br = self.valueAtRowCol(
-                int(row), int(col), resolution_, agg, includeAggParts
+            union_value, aggValues, tl, br = self.cached_value_at_row_col(
+                row, col, resolution_, agg, ignoreNoData, includeAggParts
             )
 
             if agg == "none":
@@ -151,6 +242,67 @@ class RectMeterGrid(
             else:
                 return (union_value, tl, br) if returnRowCols else union_value
 
+    def closest_values_at(self, latlon_coords, ignore_nodata, resolution, agg="none"):
+        """Batched variant of closestValueAt for many coordinates at once.
+        latlon_coords is a list of Geo.LatLonCoord (or anything with lat and lon attributes)
+        and resolution is given in meter.
+        Returns the list of values and the list of the according row/cols."""
+        no_of_coords = len(latlon_coords)
+        lats = np.fromiter((c.lat for c in latlon_coords), float, count=no_of_coords)
+        lons = np.fromiter((c.lon for c in latlon_coords), float, count=no_of_coords)
+        if no_of_coords == 0:
+            return [], []
+
+        rs, hs = self._latlon_to_grid_crs.transform(lons, lats)
+        rows, cols = self._index.row_col_at(rs, hs, ignore_nodata=ignore_nodata)
+
+        if resolution <= self._cellsize:
+            values = list(map(self.to_union, self._grid[rows, cols].tolist()))
+        elif resolution % self._cellsize == 0:
+            values = [
+                self.cached_value_at_row_col(
+                    row, col, resolution, agg, ignore_nodata, False
+                )[0]
+                for row, col in zip(rows.tolist(), cols.tolist())
+            ]
+        else:
+            raise ValueError(
+                f"resolution {resolution} is not a multiple of cellsize {self._cellsize}"
+            )
+
+        row_cols = [
+            {"row": row, "col": col} for row, col in zip(rows.tolist(), cols.tolist())
+        ]
+        return values, row_cols
+
+    def tile(self, tl, br, stride=1):
+        """Return the sub grid from the top left to the bottom right row/col (inclusive),
+        taking every stride-th row and col, as one packed binary blob.
+        tl and br are Grid.RowCol (or anything with row and col attributes).
+        Returns a dict with the row-major little-endian data, its numpy dtype string,
+        the shape (rows, cols), the nodata value and the actual tl/br of the tile."""
+        stride = max(int(stride), 1)
+        top = max(int(tl.row), 0)
+        left = max(int(tl.col), 0)
+        bottom = min(int(br.row), self._nrows - 1)
+        right = min(int(br.col), self._ncols - 1)
+        if top > bottom or left > right:
+            raise ValueError(
+                f"empty tile for tl: {tl.row}/{tl.col} and br: {br.row}/{br.col}"
+            )
+
+        sub_grid = self._grid[top : bottom + 1 : stride, left : right + 1 : stride]
+        dtype = sub_grid.dtype.newbyteorder("<")
+        rows, cols = sub_grid.shape
+        return {
+            "data": np.ascontiguousarray(sub_grid, dtype=dtype).tobytes(),
+            "dtype": dtype.str,
+            "shape": (rows, cols),
+            "nodata": self._nodata,
+            "tl": {"row": top, "col": left},
+            "br": {"row": top + (rows - 1) * stride, "col": left + (cols - 1) * stride},
+        }
+
     async def valueAt(
         self, row, col, resolution, agg, includeAggParts, _context, **kwargs
     ):  # valueAt @4 (row :UInt64, col :UInt64, resolution :UInt64, agg :Aggregation = none, includeAggParts :Bool = false) -> (val :Value, aggParts :List(AggregationPart));
@@ -189,268 +341,204 @@ class RectMeterGrid(
             else:
                 return union_value
 
-    def valueAtRowCol(self, row, col, resolution, agg, includeAggParts):
-        cellsize = self._cellsize
-
-        # what is outside of main cell
-        boundary_size = resolution - cellsize
-        # divide amongst sides (left/right, top/bottom)
-        boundary_size_per_side = boundary_size // 2
+    def window_size(self, resolution):
+        """Return the number of full cells on each side of the center cell and the area fraction
+        of the outer ring of cells covered by the given resolution."""
+        # what is outside of main cell, divided amongst sides (left/right, top/bottom)
+        boundary_size_per_side = (resolution - self._cellsize) // 2
         full_cell_count, rest_outer_boundary_size = divmod(
-            boundary_size_per_side, cellsize
+            boundary_size_per_side, self._cellsize
+        )
+        return full_cell_count, rest_outer_boundary_size / self._cellsize
+
+    def window_bounds(self, row, col, resolution):
+        """Return the top, bottom, left and right (inclusive) row/col of the window of cells
+        covered by the given resolution around row/col, clipped to the grid."""
+        full_cell_count, fraction = self.window_size(resolution)
+        # include the fraction ring, if necessary
+        reach = full_cell_count + (1 if fraction > 0 else 0)
+        return (
+            max(row - reach, 0),
+            min(row + reach, self._nrows - 1),
+            max(col - reach, 0),
+            min(col + reach, self._ncols - 1),
         )
 
-        cells = [(row, col, 1.0, None)]
-        tl = {"row": row, "col": col}
-        br = {"row": row, "col": col}
-
-        # first create the fraction ring, if necessary
-        if rest_outer_boundary_size > 0:
-            # corners
-            fraction = rest_outer_boundary_size / cellsize
-
-            outer_tl = None
-            top_row = row - full_cell_count - 1
-            if top_row >= 0:
-                # top left corner
-                left_col = col - full_cell_count - 1
-                if left_col >= 0:
-                    # store top left row/col
-                    outer_tl = {"row": top_row, "col": left_col}
-                    cells.append(
-                        (
-                            top_row,
-                            left_col,
-                            fraction * fraction,
-                            (top_row + 1, left_col + 1),
-                        )
-                    )
-
-                    # top side
-                for i in range(1, 1 + (2 * full_cell_count) + 1):
-                    left_i = left_col + i
-                    if 0 <= left_i and left_i <= self._ncols - 1:
-                        # if not done yet, store top left row/col
-                        if outer_tl is None:
-                            outer_tl = {"row": top_row, "col": left_i}
-                        cells.append((top_row, left_i, fraction, (top_row + 1, left_i)))
-
-                # top right corner
-                right_col = col + full_cell_count + 1
-                if right_col <= self._ncols - 1:
-                    cells.append(
+    def window_at(self, row, col, resolution):
+        """Return the window of cells covered by the given resolution around row/col.
+        The window is returned as (rows, cols, weights, full_rows, full_cols): the row and col
+        indices of the window (clipped to the grid), the area fraction of every cell in the window
+        and for every cell the row and col index of the closest fully covered cell."""
+        full_cell_count, fraction = self.window_size(resolution)
+        top, bottom, left, right = self.window_bounds(row, col, resolution)
+        rows = np.arange(top, bottom + 1)
+        cols = np.arange(left, right + 1)
+
+        # the fraction ring gets the rest fraction, the corners the squared fraction
+        row_weights = np.where(np.abs(rows - row) > full_cell_count, fraction, 1.0)
+        col_weights = np.where(np.abs(cols - col) > full_cell_count, fraction, 1.0)
+        weights = np.outer(row_weights, col_weights)
+
+        full_rows = np.clip(rows, row - full_cell_count, row + full_cell_count)
+        full_cols = np.clip(cols, col - full_cell_count, col + full_cell_count)
+
+        return rows, cols, weights, full_rows, full_cols
+
+    def summed_area_value_at(self, row, col, resolution, agg):
+        """Calculate the sum, avg, wSum or wAvg aggregation of the window around row/col
+        in constant time from the summed area tables.
+        Returns the value and the top left and bottom right row/col of the window."""
+        full_cell_count, fraction = self.window_size(resolution)
+
+        def parts(center, size):
+            # (start, end, weight) of the full cells and the fraction ring on both sides
+            ps = [
+                (
+                    max(center - full_cell_count, 0),
+                    min(center + full_cell_count, size - 1) + 1,
+                    1,
+                )
+            ]
+            if fraction > 0:
+                if center - full_cell_count - 1 >= 0:
+                    ps.append(
                         (
-                            top_row,
-                            right_col,
-                            fraction * fraction,
-                            (top_row + 1, right_col - 1),
+                            center - full_cell_count - 1,
+                            center - full_cell_count,
+                            fraction,
                         )
                     )
-
-                    # left side
-            left_col = col - full_cell_count - 1
-            if left_col >= 0:
-                for i in range(1, 1 + (2 * full_cell_count) + 1):
-                    top_i = top_row + i
-                    if top_i >= 0:
-                        if outer_tl is None:
-                            outer_tl = {"row": top_i, "col": left_col}
-                        cells.append((top_i, left_col, fraction, (top_i, left_col + 1)))
-
-            if outer_tl is not None:
-                tl = outer_tl
-
-            outer_br = None
-            # right side
-            right_col = col + full_cell_count + 1
-            if right_col <= self._ncols - 1:
-                for i in range(1, 1 + (2 * full_cell_count) + 1):
-                    top_i = top_row + i
-                    if top_i >= 0:
-                        # store bottom right row/col
-                        outer_br = {"row": top_i, "col": right_col}
-                        cells.append(
-                            (top_i, right_col, fraction, (top_i, right_col - 1))
-                        )
-
-            bottom_row = row + full_cell_count + 1
-            if bottom_row <= self._nrows - 1:
-                # bottom left corner
-                left_col = col - full_cell_count - 1
-                if left_col >= 0:
-                    cells.append(
+                if center + full_cell_count + 1 <= size - 1:
+                    ps.append(
                         (
-                            bottom_row,
-                            left_col,
-                            fraction * fraction,
-                            (bottom_row - 1, left_col + 1),
+                            center + full_cell_count + 1,
+                            center + full_cell_count + 2,
+                            fraction,
                         )
                     )
+            return ps
+
+        def rect_sum(table, r0, r1, c0, c1):
+            return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+        row_parts = parts(row, self._nrows)
+        col_parts = parts(col, self._ncols)
+        weighted = agg[0] == "w"
+        value_sum = 0
+        count = 0
+        for r0, r1, row_weight in row_parts:
+            for c0, c1, col_weight in col_parts:
+                weight = row_weight * col_weight if weighted else 1
+                value_sum += weight * rect_sum(self._sum_table, r0, r1, c0, c1)
+                count += weight * rect_sum(self._count_table, r0, r1, c0, c1)
+
+        tl = {
+            "row": min(r0 for r0, _, _ in row_parts),
+            "col": min(c0 for c0, _, _ in col_parts),
+        }
+        br = {
+            "row": max(r1 for _, r1, _ in row_parts) - 1,
+            "col": max(c1 for _, c1, _ in col_parts) - 1,
+        }
+        if count == 0:
+            return None, tl, br
+        elif agg in ("avg", "wAvg"):
+            return value_sum / count, tl, br
+        return value_sum, tl, br
+
+    @property
+    def result_cache_stats(self):
+        """size and hit/miss counters of the aggregation result cache"""
+        return self._result_cache.stats()
+
+    def cached_value_at_row_col(
+        self, row, col, resolution, agg, ignore_nodata, include_agg_parts
+    ):
+        """valueAtRowCol, but served from the result cache if the same window
+        was aggregated before (without the aggregation parts)"""
+        if include_agg_parts or str(agg) == "none":
+            return self.valueAtRowCol(row, col, resolution, agg, include_agg_parts)
+        key = (row, col, resolution, str(agg), ignore_nodata)
+        result = self._result_cache.get(key)
+        if result is None:
+            result = self.valueAtRowCol(row, col, resolution, agg, include_agg_parts)
+            self._result_cache.put(key, result)
+        return result
 
-                    # bottom side
-                for i in range(1, 1 + (2 * full_cell_count) + 1):
-                    left_i = left_col + i
-                    if 0 <= left_i and left_i <= self._ncols - 1:
-                        # store bottom right row/col
-                        outer_br = {"row": bottom_row, "col": left_i}
-                        cells.append(
-                            (bottom_row, left_i, fraction, (bottom_row - 1, left_i))
-                        )
+    def valueAtRowCol(self, row, col, resolution, agg, includeAggParts):
+        agg = str(agg)
+        if (
+            not includeAggParts
+            and agg in ("sum", "avg", "wSum", "wAvg")
+            and self._sum_table is not None
+        ):
+            value, tl, br = self.summed_area_value_at(row, col, resolution, agg)
+            return (
+                self.to_union(self._nodata if value is None else value),
+                [],
+                tl,
+                br,
+            )
+        elif (
+            not includeAggParts and agg in ("min", "max") and self._pyramid is not None
+        ):
+            top, bottom, left, right = self.window_bounds(row, col, resolution)
+            value = self._pyramid.min_max_in(top, bottom + 1, left, right + 1, agg)
+            return (
+                self.to_union(self._nodata if value is None else value),
+                [],
+                {"row": top, "col": left},
+                {"row": bottom, "col": right},
+            )
 
-                # bottom right corner
-                right_col = col + full_cell_count + 1
-                if right_col <= self._ncols - 1:
-                    # store bottom right row/col
-                    outer_br = {"row": bottom_row, "col": right_col}
-                    cells.append(
-                        (
-                            bottom_row,
-                            right_col,
-                            fraction * fraction,
-                            (bottom_row - 1, right_col - 1),
-                        )
-                    )
+        rows, cols, weights, full_rows, full_cols = self.window_at(row, col, resolution)
+        tl = {"row": int(rows[0]), "col": int(cols[0])}
+        br = {"row": int(rows[-1]), "col": int(cols[-1])}
 
-            if outer_br is not None:
-                br = outer_br
-
-        inner_tl = None
-        inner_br = None
-        # create the inner full columns
-        for row_i in range(-full_cell_count, full_cell_count + 1):
-            r = row + row_i
-            if r >= 0 and r <= self._nrows - 1:
-                for col_i in range(-full_cell_count, full_cell_count + 1):
-                    c = col + col_i
-                    if c >= 0 and c <= self._ncols - 1 and not (r == row and c == col):
-                        # if not set previously, store top left row/col
-                        if inner_tl is None:
-                            inner_tl = {"row": r, "col": c}
-                        # store bottom right row col
-                        inner_br = {"row": r, "col": c}
-                        cells.append((r, c, 1.0, None))
-
-        if outer_tl is None and inner_tl is not None:
-            tl = inner_tl
-        if outer_br is None and inner_br is not None:
-            br = inner_br
-
-        value = self._nodata
-        values = []
-        weighted_values = []
-        rc_to_val = {}
-        rc_to_agg_val = {}
-        # calc weighted values
-        for r, c, frac, _ in cells:
-            val = self._grid[r, c]
-            if agg == "none" or includeAggParts:
-                rc_to_agg_val[(r, c)] = {
-                    "value": self.to_union(val),
-                    "rowCol": {"row": r, "col": c},
-                    "areaFrac": frac,
-                    "iValue": 0,
-                }
-            if val == self._nodata:
-                continue
-            rc_to_val[(r, c)] = val
-            values.append(val)
-            weighted_values.append((val * frac, frac))
+        window = self._grid[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+        valid = window != self._nodata
 
         # if the aggregation demands it, calc actually interpolated values for the outer cells
-        interpolated_values = []
-        if str(agg)[0] == "i":
-            for r, c, frac, closest_full_cell in cells:
-                if int(frac) == 1 or closest_full_cell is None:
-                    interpolated_values.append(rc_to_val[(r, c)])
-                    continue
-
-                (fr, fc) = closest_full_cell
-
-                dr = abs(r - fr)
-                dc = abs(c - fc)
+        i_values = None
+        if agg[0] == "i":
+            full_values = self._grid[np.ix_(full_rows, full_cols)]
+            i_values = np.where(
+                weights < 1.0, full_values * (1.0 + np.sqrt(weights)) / 2.0, window
+            )
+            # outer cells are interpolated from their closest full cell only
+            i_valid = full_values != self._nodata
+
+        agg_parts = []
+        if agg == "none" or includeAggParts:
+            i_vs = (
+                np.where(i_valid, i_values, 0.0).tolist()
+                if i_values is not None
+                else np.zeros(window.shape).tolist()
+            )
+            for wr, r in enumerate(rows.tolist()):
+                for wc, c in enumerate(cols.tolist()):
+                    agg_parts.append(
+                        {
+                            "value": self.to_union(window[wr, wc]),
+                            "rowCol": {"row": r, "col": c},
+                            "areaFrac": float(weights[wr, wc]),
+                            "iValue": i_vs[wr][wc],
+                        }
+                    )
 
-                full_dist = math.sqrt(dr * cellsize**2 + dc * cellsize**2)
-                half_full_dist = math.sqrt(
-                    dr * (cellsize / 2) ** 2 + dc * (cellsize / 2) ** 2
-                )
-                half_short_dist = math.sqrt(
-                    dr * frac * (cellsize / 2) ** 2 + dc * frac * (cellsize / 2) ** 2
-                )
+        value = None
+        if agg != "none":
+            if i_values is None:
+                value = aggregate(agg, window[valid], weights[valid])
+            else:
+                value = aggregate(agg, i_values[i_valid], weights[i_valid])
 
-                fval = rc_to_val[(fr, fc)]
-                interpol_value = fval * (half_full_dist + half_short_dist) / full_dist
-
-                interpolated_values.append(interpol_value)
-                if includeAggParts:
-                    rc_to_agg_val[(r, c)]["iValue"] = float(interpol_value)
-
-        if len(values) > 0:
-            if agg == "avg":
-                # calc average
-                value = sum(values) / len(values) if len(values) > 0 else 0
-            elif agg == "wAvg":
-                # calc weighted average https://www.indeed.com/career-advice/career-development/how-to-calculate-weighted-average
-                value = sum(map(lambda t: t[0], weighted_values)) / sum(
-                    map(lambda t: t[1], weighted_values)
-                )
-            elif agg == "iAvg":
-                # calc interpolated average
-                value = (
-                    sum(interpolated_values) / len(interpolated_values)
-                    if len(interpolated_values) > 0
-                    else 0
-                )
-            elif agg == "median":
-                # calc median
-                values.sort()
-                d, m = divmod(len(values), 2)
-                if m == 0:
-                    value = (values[d - 1] + values[d]) / 2
-                else:
-                    value = values[d]
-            elif agg == "wMedian":
-                # calc weighted median https://www.datablick.com/blog/2017/7/3/weighted-medians-for-weighted-data-in-tableau
-                weighted_values.sort(key=lambda t: t[0])
-                sum_fractions = sum(map(lambda t: t[1], weighted_values))
-                running_fraction = 0
-                for i, (weighted_value, frac) in enumerate(weighted_values):
-                    running_fraction += frac
-                    if running_fraction / sum_fractions > 0.5:
-                        value = weighted_value
-                        break
-                    elif running_fraction / sum_fractions == 0.5:
-                        value = (
-                            weighted_value + weighted_values[i + 1][0]
-                        ) / 2.0  # it should be impossible to have no i+1 if == 0.5
-                        break
-            elif agg == "iMedian":
-                # calc interpolated median
-                interpolated_values.sort()
-                d, m = divmod(len(interpolated_values), 2)
-                if m == 0:
-                    value = (interpolated_values[d - 1] + interpolated_values[d]) / 2
-                else:
-                    value = interpolated_values[d]
-            elif agg == "min":
-                value = min(values)
-            elif agg == "wMin":
-                value = min(map(lambda t: t[0], weighted_values))
-            elif agg == "iMin":
-                value = min(interpolated_values)
-            elif agg == "max":
-                value = max(values)
-            elif agg == "wMax":
-                value = max(map(lambda t: t[0], weighted_values))
-            elif agg == "iMax":
-                value = max(interpolated_values)
-            elif agg == "sum":
-                value = sum(values)
-            elif agg == "wSum":
-                value = sum(map(lambda t: t[0], weighted_values))
-            elif agg == "iSum":
-                value = sum(interpolated_values)
-
-        return (self.to_union(value), list(rc_to_agg_val.values()), tl, br)
+        return (
+            self.to_union(self._nodata if value is None else value),
+            agg_parts,
+            tl,
+            br,
+        )
 
     async def resolution(self, **kwargs):  # resolution @1 () -> (res :Resolution);
         return {"meter": self._cellsize}
@@ -493,6 +581,79 @@ class RectMeterGrid(
             {"lat": bl_lat, "lon": bl_lon},
         )
 
+    async def streamCells(
+        self, topLeft, bottomRight, _context, **kwargs
+    ):  # streamCells @6 (topLeft :RowCol, bottomRight :RowCol) -> (callback :Callback);
+        # without a bottom right corner stream everything to the end of the grid
+        if _context.params._has("bottomRight"):
+            bottom, right = bottomRight.row, bottomRight.col
+        else:
+            bottom, right = self._nrows - 1, self._ncols - 1
+        _context.results.callback = CellsStream(
+            self, topLeft.row, bottom, topLeft.col, right
+        )
+
+    def valid_cells_in_rows(self, top, bottom, left, right):
+        """return the rows and cols of the valid cells in the rows top to bottom
+        and cols left to right (inclusive) in row-major order"""
+        return self._index.valid_rows_cols_in(top, bottom, left, right)
+
+    def locations(self, rows, cols):
+        """Return the Grid.Locations (lat/lon of the cell center, row/col and value)
+        of the given rows and cols. The lat/lon coordinates are transformed in one go."""
+        rs, hs = self._index.cell_centers(rows, cols)
+        lons, lats = self._grid_crs_to_latlon.transform(rs, hs)
+        values = self._grid[rows, cols].tolist()
+        return [
+            {
+                "latLonCoord": {"lat": lat, "lon": lon},
+                "rowCol": {"row": row, "col": col},
+                "value": self.to_union(value),
+            }
+            for row, col, lat, lon, value in zip(
+                rows.tolist(),
+                cols.tolist(),
+                np.asarray(lats).tolist(),
+                np.asarray(lons).tolist(),
+                values,
+            )
+        ]
+
+
+class CellsStream(grid_capnp.Grid.Callback.Server):
+    """Pages through the valid cells of a rectangle of a grid in row-major order."""
+
+    def __init__(self, grid, top, bottom, left, right):
+        self._grid = grid
+        self._next_row = max(top, 0)
+        self._bottom = min(bottom, grid._nrows - 1)
+        self._left = max(left, 0)
+        self._right = min(right, grid._ncols - 1)
+        # valid cells already found, but not sent yet
+        self._rows = np.empty(0, dtype=np.int64)
+        self._cols = np.empty(0, dtype=np.int64)
+
+    async def sendCells(self, maxCount, **kwargs):
+        # sendCells @0 (maxCount :Int64) -> (locations :List(Location));
+        max_count = maxCount if maxCount > 0 else 100
+        width = max(self._right - self._left + 1, 1)
+        while len(self._rows) < max_count and self._next_row <= self._bottom:
+            # read enough rows to probably fill the page
+            bottom = min(
+                self._next_row + (max_count - len(self._rows)) // width,
+                self._bottom,
+            )
+            rows, cols = self._grid.valid_cells_in_rows(
+                self._next_row, bottom, self._left, self._right
+            )
+            self._rows = np.concatenate((self._rows, rows))
+            self._cols = np.concatenate((self._cols, cols))
+            self._next_row = bottom + 1
+
+        rows, self._rows = self._rows[:max_count], self._rows[max_count:]
+        cols, self._cols = self._cols[:max_count], self._cols[max_count:]
+        return self._grid.locations(rows, cols)
+
 
 async def main():
     parser = serv.create_default_args_parser("ASCII Grid Service")
@@ -513,6 +674,10 @@ async def main():
         name=cs.get("name"),
         description=cs.get("description"),
         restorer=restorer,
+        pyramid_levels=cs.get("pyramid_levels", 0),
+        result_cache_size=cs.get("result_cache_size", 0),
+        result_cache_max_bytes=cs.get("result_cache_max_bytes", 64 * 1024 * 1024),
+        summed_area_tables=cs.get("summed_area_tables", False),
     )
     await serv.init_and_run_service_from_config(
         config=config, service=service, restorer=restorer
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import asyncio
+import uuid
+
+import capnp
+import numpy as np
+from pyproj import CRS, Transformer
+from zalfmas_capnp_schemas_with_stubs import grid_capnp
+from zalfmas_common import common, geo
+from zalfmas_common import service as serv
+
+from zalfmas_services.grid import grid_cache, grid_index
+from zalfmas_services.grid.ascii_grid import RectMeterGrid
+
+ALIGNMENT_KEYS = ["ncols", "nrows", "xllcorner", "yllcorner", "cellsize"]
+
+
+class RectMeterGridStack(
+    grid_capnp.Grid.Server,
+    common.Identifiable,
+    common.Persistable,
+    serv.AdministrableService,
+):
+    """A stack of aligned ascii grids (same extent, cellsize and crs), e.g. DEM, slope
+    and soil id. Every layer keeps its own (memory mapped) grid and datatype.
+    The lat/lon -> row/col lookup is done once for all layers: the stack itself is a Grid
+    capability returning the values of all layers at once (see closestValueAt), each
+    layer is additionally available as Grid capability of its own.
+    All layers share the transformers and the index of the stack, so ignoring nodata
+    (and streaming cells) is based on the cells valid in all layers."""
+
+    def __init__(
+        self,
+        layers,
+        grid_crs,
+        id=None,
+        name=None,
+        description=None,
+        admin=None,
+        restorer=None,
+        pyramid_levels=0,
+        result_cache_size=0,
+        result_cache_max_bytes=64 * 1024 * 1024,
+        summed_area_tables=False,
+    ):
+        """layers is a list of dicts with name, path_to_ascii_grid, val_type
+        (int or float) and optionally id and description of the layer"""
+        common.Identifiable.__init__(self, id, name, description)
+        common.Persistable.__init__(self, restorer)
+        serv.AdministrableService.__init__(self, admin)
+
+        self._id = str(id if id else uuid.uuid4())
+        self._name = name if name else "stack"
+        self._description = (
+            description
+            if description
+            else "Values of the layers "
+            + ", ".join(layer["name"] for layer in layers)
+            + " (in this order) as aggregation parts."
+        )
+
+        self._grid_crs = grid_crs
+        wgs84 = geo.name_to_crs("latlon")
+        self._latlon_to_grid_crs = Transformer.from_crs(wgs84, grid_crs, always_xy=True)
+        grid_crs_to_latlon = Transformer.from_crs(grid_crs, wgs84, always_xy=True)
+
+        grids = []
+        metadatas = []
+        for layer in layers:
+            grid, metadata = grid_cache.load_grid_and_metadata_from_ascii_grid(
+                layer["path_to_ascii_grid"], datatype=layer["val_type"]
+            )
+            if metadatas and any(
+                metadata[k] != metadatas[0][k] for k in ALIGNMENT_KEYS
+            ):
+                raise ValueError(
+                    f"grid {layer['path_to_ascii_grid']} is not aligned with grid "
+                    f"{layers[0]['path_to_ascii_grid']}"
+                )
+            grids.append(grid)
+            metadatas.append(metadata)
+        self._grids = grids
+        self._metadata = metadatas[0]
+        self._cellsize = int(self._metadata["cellsize"])
+
+        # cells valid in all layers, for looking up the closest valid cell of the stack
+        valid = np.ones(grids[0].shape, dtype=np.int8)
+        for grid, metadata in zip(grids, metadatas):
+            valid &= grid != metadata["nodata_value"]
+        self._index = grid_index.RectGridIndex(
+            valid, dict(self._metadata, nodata_value=0)
+        )
+
+        self._layers = {}
+        for i, (layer, metadata) in enumerate(zip(layers, metadatas)):
+            self._layers[layer["name"]] = RectMeterGrid(
+                path_to_ascii_grid=layer["path_to_ascii_grid"],
+                grid_crs=grid_crs,
+                val_type=layer["val_type"],
+                id=layer.get("id"),
+                name=layer["name"],
+                description=layer.get("description"),
+                restorer=restorer,
+                grid=grids[i],
+                metadata=metadata,
+                pyramid_levels=pyramid_levels,
+                result_cache_size=result_cache_size,
+                result_cache_max_bytes=result_cache_max_bytes,
+                summed_area_tables=summed_area_tables,
+                index=self._index,
+                latlon_to_grid_crs=self._latlon_to_grid_crs,
+                grid_crs_to_latlon=grid_crs_to_latlon,
+            )
+        self._first_layer = next(iter(self._layers.values()))
+
+    @property
+    def layers(self):
+        """the layers by name as Grid capabilities"""
+        return self._layers
+
+    def values_at_row_col(self, row, col, resolution, agg="none", ignore_nodata=False):
+        """Return the values of all layers at row/col (resolution <= cellsize) or their
+        agg aggregations of the window around row/col (resolution a multiple of cellsize).
+        Returns the values by layer name and the top left and bottom right row/col."""
+        if resolution <= self._cellsize:
+            values = {
+                name: layer.to_union(grid[row, col])
+                for (name, layer), grid in zip(self._layers.items(), self._grids)
+            }
+            return values, {"row": row, "col": col}, {"row": row, "col": col}
+        elif resolution % self._cellsize == 0:
+            values = {}
+            for name, layer in self._layers.items():
+                values[name], _, tl, br = layer.cached_value_at_row_col(
+                    row, col, resolution, agg, ignore_nodata, False
+                )
+            return values, tl, br
+        raise ValueError(
+            f"resolution {resolution} is not a multiple of cellsize {self._cellsize}"
+        )
+
+    def closest_values_at(self, latlon_coord, ignore_nodata, resolution, agg="none"):
+        """Return the values of all layers at the cell closest to the given lat/lon coordinate.
+        If ignore_nodata is True, the closest cell valid in all layers is used.
+        resolution (in meter) and agg are handled like in Grid.closestValueAt.
+        Returns the values by layer name and the row/col of the cell."""
+        r, h = self._latlon_to_grid_crs.transform(latlon_coord.lon, latlon_coord.lat)
+        row, col = self._index.row_col_at(r, h, ignore_nodata=ignore_nodata)
+        values, _, _ = self.values_at_row_col(row, col, resolution, agg, ignore_nodata)
+        return values, {"row": row, "col": col}
+
+    def set_layer_values(self, results, values, row_col):
+        """set the values of the layers as aggregation parts (in the order of the layers)
+        and the value of the first layer as val of the results"""
+        results.val = next(iter(values.values()))
+        parts = results.init("aggParts", len(values))
+        for part, value in zip(parts, values.values()):
+            part.value = value
+            part.rowCol = row_col
+            part.areaFrac = 1.0
+
+    async def closestValueAt(
+        self,
+        latlonCoord,
+        ignoreNoData,
+        resolution,
+        agg,
+        returnRowCols,
+        includeAggParts,
+        _context,
+        **kwargs,
+    ):  # closestValueAt @0 (latlonCoord :Geo.LatLonCoord, ignoreNoData :Bool, resolution :UInt64, agg :Aggregation = none, includeAggParts :Bool = false) -> (val :Value, tl :RowCol, br :RowCol, aggParts :List(AggregationPart));
+        # the aggregation parts are the values of all layers at the closest cell
+        # (or their agg aggregations), the cell is looked up only once for all layers
+        resolution_ = (
+            resolution.meter if resolution.which() == "meter" else resolution.degree
+        )
+        r, h = self._latlon_to_grid_crs.transform(latlonCoord.lon, latlonCoord.lat)
+        row, col = self._index.row_col_at(r, h, ignore_nodata=ignoreNoData)
+        values, tl, br = self.values_at_row_col(
+            row, col, resolution_, str(agg), ignoreNoData
+        )
+        self.set_layer_values(_context.results, values, {"row": row, "col": col})
+        if returnRowCols:
+            _context.results.tl = tl
+            _context.results.br = br
+
+    async def valueAt(
+        self, row, col, resolution, agg, includeAggParts, _context, **kwargs
+    ):  # valueAt @4 (row :UInt64, col :UInt64, resolution :UInt64, agg :Aggregation = none, includeAggParts :Bool = false) -> (val :Value, aggParts :List(AggregationPart));
+        resolution_ = (
+            resolution.meter if resolution.which() == "meter" else resolution.degree
+        )
+        nrows, ncols = self._grids[0].shape
+        if 0 <= row < nrows and 0 <= col < ncols:
+            values, _, _ = self.values_at_row_col(row, col, resolution_, str(agg))
+            self.set_layer_values(_context.results, values, {"row": row, "col": col})
+
+    async def resolution(self, **kwargs):  # resolution @1 () -> (res :Resolution);
+        return {"meter": self._cellsize}
+
+    async def dimension(
+        self, **kwargs
+    ):  # dimension @2 () -> (rows :UInt64, cols :UInt64);
+        return self._grids[0].shape
+
+    async def latLonBounds(
+        self, useCellCenter, **kwargs
+    ):  # latLonBounds @5 (useCellCenter :Bool = false) -> (tl :Geo.LatLonCoord, tr :Geo.LatLonCoord, br :Geo.LatLonCoord, bl :Geo.LatLonCoord);
+        return await self._first_layer.latLonBounds(useCellCenter)
+
+
+async def main():
+    parser = serv.create_default_args_parser("ASCII Grid Stack Service")
+    config, _ = serv.handle_default_service_args(parser, path_to_service_py=__file__)
+
+    cs = config["service"]
+    cv = config["vat"]
+
+    restorer = common.Restorer()
+    if "epsg_code" in cs:
+        crs = CRS.from_epsg(cs["epsg_code"])
+    else:
+        crs = geo.name_to_crs(cs["grid_crs"])
+    stack = RectMeterGridStack(
+        layers=[
+            dict(layer, val_type=int if layer["val_type"] == "int" else float)
+            for layer in cs["layers"]
+        ],
+        grid_crs=crs,
+        id=cs.get("id"),
+        name=cs.get("name", "stack"),
+        description=cs.get("description"),
+        restorer=restorer,
+        pyramid_levels=cs.get("pyramid_levels", 0),
+        result_cache_size=cs.get("result_cache_size", 0),
+        result_cache_max_bytes=cs.get("result_cache_max_bytes", 64 * 1024 * 1024),
+        summed_area_tables=cs.get("summed_area_tables", False),
+    )
+    # the stack (all layers at once) and every layer on its own
+    name_to_service = {stack.name: stack, **stack.layers}
+    fixed_srts = cs.get("fixed_sturdy_ref_tokens", {})
+    await serv.init_and_run_service(
+        name_to_service=name_to_service,
+        name_to_service_srs={name: fixed_srts.get(name) for name in name_to_service},
+        host=cv.get("host", None),
+        port=cv.get("port", None),
+        serve_bootstrap=cv.get("serve_bootstrap", True),
+        registries=cs.get("registries", None),
+        resolvers=cv.get("resolvers", None),
+        gateways=cs.get("gateways", None),
+        restorer=restorer,
+        restorer_container_sr=cv.get("restorer_container_sr", None),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(capnp.run(main()))
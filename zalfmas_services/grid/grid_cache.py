@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+from zalfmas_common import rect_ascii_grid_management as grid_man
+
+from zalfmas_services import sidecar_cache
+
+
+def sidecar_paths(path_to_ascii_grid):
+    """return the paths to the binary grid and its json header next to the ascii grid"""
+    path_to_npy = str(path_to_ascii_grid) + ".npy"
+    return path_to_npy, path_to_npy + ".json"
+
+
+def load_cached_grid(path_to_ascii_grid, datatype=int):
+    """Load the grid from the binary sidecar of the ascii grid, if it is still valid.
+    The grid is memory mapped read-only, so multiple processes share the same pages.
+    Returns (grid, metadata) or None if there is no valid sidecar."""
+    path_to_npy, path_to_header = sidecar_paths(path_to_ascii_grid)
+    header = sidecar_cache.load_header(
+        path_to_header, [path_to_ascii_grid], dtype=np.dtype(datatype).str
+    )
+    if header is None:
+        return None
+    try:
+        grid = np.load(path_to_npy, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return grid, header["metadata"]
+
+
+def store_cached_grid(path_to_ascii_grid, grid, metadata, datatype=int):
+    """Write the grid as binary sidecar next to the ascii grid.
+    Returns True if the sidecar could be written."""
+    path_to_npy, path_to_header = sidecar_paths(path_to_ascii_grid)
+    try:
+        header = sidecar_cache.source_key(
+            [path_to_ascii_grid], dtype=np.dtype(datatype).str
+        )
+        header["metadata"] = metadata
+        sidecar_cache.remove_header(path_to_header)
+        sidecar_cache.write_file(
+            path_to_npy,
+            lambda _: np.save(_, np.ascontiguousarray(grid, dtype=datatype)),
+        )
+        sidecar_cache.write_header(path_to_header, header)
+    except OSError as e:
+        print("Couldn't write grid cache for", path_to_ascii_grid, "due to", e)
+        return False
+    return True
+
+
+def load_grid_and_metadata_from_ascii_grid(path_to_ascii_grid, datatype=int):
+    """Load the grid and metadata of an ascii grid via its binary sidecar.
+    On first load (or if the ascii grid changed since) the ascii grid is parsed
+    and the sidecar created, afterwards the sidecar is memory mapped."""
+    cached = load_cached_grid(path_to_ascii_grid, datatype)
+    if cached is not None:
+        return cached
+
+    grid, metadata = grid_man.load_grid_and_metadata_from_ascii_grid(
+        path_to_ascii_grid, datatype=datatype
+    )
+    if store_cached_grid(path_to_ascii_grid, grid, metadata, datatype):
+        cached = load_cached_grid(path_to_ascii_grid, datatype)
+        if cached is not None:
+            return cached
+    return grid, metadata
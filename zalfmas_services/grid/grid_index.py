@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class RectGridIndex:
+    """Row/col lookup for a regular rectangular grid (e.g. an ascii grid).
+    The cell containing a coordinate is calculated directly, only if nodata cells
+    have to be skipped a nearest neighbour search over the valid cells is necessary.
+    The search tree for that is built on first use.
+    The rows and cols of the valid cells can be given, if they are known already."""
+
+    def __init__(self, grid, metadata, valid_rows_cols=None):
+        self._grid = grid
+        self._nrows, self._ncols = grid.shape
+        self._cellsize = int(metadata["cellsize"])
+        self._xll = int(metadata["xllcorner"])
+        self._yll = int(metadata["yllcorner"])
+        self._nodata = metadata["nodata_value"]
+        self._yul = self._yll + self._nrows * self._cellsize
+        self._valid_rows_cols = valid_rows_cols
+        self._valid_cells_tree = None
+
+    @property
+    def valid_rows_cols(self):
+        """rows and cols of all valid cells in row-major order"""
+        if self._valid_rows_cols is None:
+            self._valid_rows_cols = np.nonzero(self._grid != self._nodata)
+        return self._valid_rows_cols
+
+    @property
+    def valid_cells_tree(self):
+        if self._valid_cells_tree is None:
+            rows, cols = self.valid_rows_cols
+            rs, hs = self.cell_centers(rows, cols)
+            self._valid_cells_tree = cKDTree(np.column_stack((rs, hs)))
+        return self._valid_cells_tree
+
+    def valid_rows_cols_in(self, top, bottom, left, right):
+        """rows and cols of the valid cells in the window from top to bottom and left to right
+        (inclusive) in row-major order"""
+        window = self._grid[top : bottom + 1, left : right + 1]
+        rows, cols = np.nonzero(window != self._nodata)
+        return rows + top, cols + left
+
+    def window_at(self, r_min, h_min, r_max, h_max):
+        """Return the window (top, bottom, left, right) of the cells (partly) covered by
+        the rectangle given in rect coordinates, clipped to the grid, or None if the
+        rectangle is outside of the grid."""
+        if (
+            r_max < self._xll
+            or r_min >= self._xll + self._ncols * self._cellsize
+            or h_max <= self._yll
+            or h_min > self._yul
+        ):
+            return None
+        (top, bottom), (left, right) = self.row_col_at(
+            np.array([r_min, r_max]), np.array([h_max, h_min])
+        )
+        return int(top), int(bottom), int(left), int(right)
+
+    def cell_centers(self, rows, cols):
+        """return the rect coordinates of the centers of the given rows and cols"""
+        rs = self._xll + self._cellsize // 2 + np.asarray(cols) * self._cellsize
+        hs = self._yul - self._cellsize // 2 - np.asarray(rows) * self._cellsize
+        return rs, hs
+
+    def row_col_at(self, r, h, ignore_nodata=False):
+        """Return the row and col of the cell closest to the rect coordinate(s) r, h.
+        If ignore_nodata is True, the closest cell with a valid value is returned.
+        r and h can be scalars or arrays, the result will be the same."""
+        scalar = np.ndim(r) == 0
+        rs = np.atleast_1d(np.asarray(r, dtype=np.float64))
+        hs = np.atleast_1d(np.asarray(h, dtype=np.float64))
+
+        # points outside the grid are closest to the cells at the border
+        rows = np.clip(
+            np.floor((self._yul - hs) / self._cellsize), 0, self._nrows - 1
+        ).astype(np.int64)
+        cols = np.clip(
+            np.floor((rs - self._xll) / self._cellsize), 0, self._ncols - 1
+        ).astype(np.int64)
+
+        if ignore_nodata:
+            nodata = self._grid[rows, cols] == self._nodata
+            if nodata.any():
+                _, idxs = self.valid_cells_tree.query(
+                    np.column_stack((rs[nodata], hs[nodata]))
+                )
+                valid_rows, valid_cols = self.valid_rows_cols
+                rows[nodata] = valid_rows[idxs]
+                cols[nodata] = valid_cols[idxs]
+
+        if scalar:
+            return int(rows[0]), int(cols[0])
+        return rows, cols
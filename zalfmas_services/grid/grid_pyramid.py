@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+
+
+def _block_reduce(array, pad_value, reduce):
+    """reduce non overlapping 2x2 blocks of array,
+    odd shapes are padded with pad_value"""
+    rows, cols = array.shape
+    if rows % 2 or cols % 2:
+        padded = np.full((rows + rows % 2, cols + cols % 2), pad_value, array.dtype)
+        padded[:rows, :cols] = array
+        array = padded
+    blocks = array.reshape(array.shape[0] // 2, 2, array.shape[1] // 2, 2)
+    return reduce(blocks, axis=(1, 3))
+
+
+class GridPyramid:
+    """Coarsened levels of a grid, level l aggregates blocks of 2^l x 2^l cells
+    (aligned to the top left corner of the grid) into their min and max.
+    Nodata cells are left out of the aggregations."""
+
+    def __init__(self, grid, nodata, max_levels):
+        self._grid = grid
+        self._nodata = nodata
+        self._nrows, self._ncols = grid.shape
+
+        if grid.dtype.kind in "iu":
+            info = np.iinfo(grid.dtype)
+            self._min_sentinel, self._max_sentinel = info.max, info.min
+        else:
+            self._min_sentinel, self._max_sentinel = np.inf, -np.inf
+
+        # level 0 is the grid itself and is never materialized
+        self._levels = [None]
+        valid = grid != nodata
+        mins = np.where(valid, grid, self._min_sentinel).astype(grid.dtype)
+        maxs = np.where(valid, grid, self._max_sentinel).astype(grid.dtype)
+        while len(self._levels) <= max_levels and max(mins.shape) > 1:
+            mins = _block_reduce(mins, self._min_sentinel, np.min)
+            maxs = _block_reduce(maxs, self._max_sentinel, np.max)
+            self._levels.append({"min": mins, "max": maxs})
+
+    @property
+    def no_of_levels(self):
+        """the number of coarsened levels (without the grid itself)"""
+        return len(self._levels) - 1
+
+    def level(self, level):
+        """Return the arrays of the given level as dict with min and max.
+        Blocks without any valid cell are nodata."""
+        lvl = self._levels[level]
+        return {
+            "min": np.where(lvl["min"] == self._min_sentinel, self._nodata, lvl["min"]),
+            "max": np.where(lvl["max"] == self._max_sentinel, self._nodata, lvl["max"]),
+        }
+
+    def _best_level(self, top, bottom, left, right):
+        """return the level which needs to touch the least cells to cover the window"""
+        area = (bottom - top) * (right - left)
+        best_level, best_cost = 0, area
+        for level in range(1, len(self._levels)):
+            size = 1 << level
+            rows = bottom // size + -top // size
+            cols = right // size + -left // size
+            if rows <= 0 or cols <= 0:
+                break
+            cost = rows * cols + area - rows * cols * size * size
+            if cost < best_cost:
+                best_level, best_cost = level, cost
+        return best_level
+
+    def min_max_in(self, top, bottom, left, right, agg):
+        """Return the min or max (agg) of the valid cells in the rows top to bottom
+        and cols left to right (exclusive), or None if there are no valid cells.
+        The aligned inner blocks are taken from the best fitting level,
+        the border strips around them from the grid itself."""
+        reduce, sentinel = (
+            (np.min, self._min_sentinel)
+            if agg == "min"
+            else (np.max, self._max_sentinel)
+        )
+
+        level = self._best_level(top, bottom, left, right)
+        if level == 0:
+            strips = [(top, bottom, left, right)]
+            candidates = []
+        else:
+            size = 1 << level
+            b_top, b_bottom = -(-top // size), bottom // size
+            b_left, b_right = -(-left // size), right // size
+            blocks = self._levels[level][agg][b_top:b_bottom, b_left:b_right]
+            candidates = [reduce(blocks)]
+            i_top, i_bottom = b_top * size, b_bottom * size
+            i_left, i_right = b_left * size, b_right * size
+            strips = [
+                (top, i_top, left, right),
+                (i_bottom, bottom, left, right),
+                (i_top, i_bottom, left, i_left),
+                (i_top, i_bottom, i_right, right),
+            ]
+
+        for r0, r1, c0, c1 in strips:
+            if r0 < r1 and c0 < c1:
+                window = self._grid[r0:r1, c0:c1]
+                values = window[window != self._nodata]
+                if len(values) > 0:
+                    candidates.append(reduce(values))
+
+        value = reduce(candidates) if candidates else sentinel
+        return None if value == sentinel else value
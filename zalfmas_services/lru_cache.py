@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def deep_sizeof(obj):
+    """estimate the bytes used by obj including the dicts, lists, tuples and sets in it"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v) for v in obj)
+    return size
+
+
+class LRUCache:
+    """A bounded least recently used cache which counts its hits and misses.
+    The cache is bounded by the number of entries (max_size) and, if a sizeof function
+    to estimate the bytes of an entry is given, optionally by the bytes of all entries
+    (max_bytes). A max_size of 0 (or less) disables the cache, nothing will be stored.
+    The cache can be used from multiple threads."""
+
+    def __init__(self, max_size, max_bytes=0, sizeof=None):
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """return the cached value for key (marking it as recently used) or default"""
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self._misses += 1
+                return default
+            self._hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        """store value under key and evict the least recently used entries if full"""
+        if self._max_size <= 0:
+            return
+        size = self._sizeof(value) if self._sizeof else 0
+        with self._lock:
+            self._bytes += size - self._sizes.get(key, 0)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size or (
+                self._max_bytes > 0 and self._bytes > self._max_bytes
+            ):
+                old_key, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the number of entries, the max size, the hit and miss counters and
+        the hit ratio. If entries are sized, also the estimated bytes and the max bytes."""
+        lookups = self._hits + self._misses
+        stats = {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": self._hits / lookups if lookups > 0 else 0.0,
+        }
+        if self._sizeof:
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self._max_bytes
+        return stats
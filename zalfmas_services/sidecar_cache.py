@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+
+# Data derived from source files (e.g. a binary copy of an ascii grid) is cached in
+# files next to them, described by a json header. The header holds the key of the
+# sources (modification time and size of every source file plus further entries the
+# data depends on), so the cached data is only used as long as the sources don't change.
+# The data files are written via temporary files, the header is removed first and
+# written last, so partially written data will never be used.
+
+
+def source_key(paths, **entries):
+    """Return the key of the source files at paths (their modification time and size)
+    together with the given entries. Raises an OSError if a source file is missing."""
+    sources = {}
+    for path in paths:
+        st = os.stat(path)
+        sources[os.path.abspath(path)] = {
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+        }
+    return dict(entries, sources=sources)
+
+
+def load_header(path_to_header, paths, **entries):
+    """return the json header, if it exists and is still valid for the source files
+    at paths and the entries, else None"""
+    try:
+        with open(path_to_header) as _:
+            header = json.load(_)
+        key = source_key(paths, **entries)
+    except (OSError, ValueError):
+        return None
+    if any(header.get(k) != v for k, v in key.items()):
+        return None
+    return header
+
+
+def tmp_path(path):
+    """the temporary path the file at path is written to before replacing it"""
+    return f"{path}.{os.getpid()}.tmp"
+
+
+def write_file(path, write, binary=True):
+    """write the file at path by calling write with the opened temporary file,
+    which then replaces the file at path"""
+    path_to_tmp = tmp_path(path)
+    with open(path_to_tmp, "wb" if binary else "w") as _:
+        write(_)
+    os.replace(path_to_tmp, path)
+
+
+def remove_header(path_to_header):
+    """remove the header, so the old one can't validate the data while it is replaced"""
+    if os.path.exists(path_to_header):
+        os.remove(path_to_header)
+
+
+def write_header(path_to_header, header):
+    """write the json header, after all the data it describes has been written"""
+    write_file(path_to_header, lambda _: json.dump(header, _), binary=False)
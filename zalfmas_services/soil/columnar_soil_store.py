@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+from zalfmas_common.soil import soil_io
+
+
+def _column(values):
+    """return values as numpy array of the tightest fitting kind (bool, float or object)"""
+    if all(isinstance(v, bool) for v in values):
+        return np.array(values, dtype=bool)
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return np.array(values, dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class ColumnarSoilStore:
+    """All profile groups of a soil database held column wise in numpy arrays.
+    Profiles and layers are stored consecutively (ordered by soil id), every layer parameter
+    is one column over all layers together with a mask where the parameter is set.
+    A profile group is a slice of the profiles, a profile a slice of the layers."""
+
+    def __init__(self, profile_groups):
+        """profile_groups as returned by soil_io.get_soil_profile_group (without units)"""
+        profile_groups = sorted(profile_groups, key=lambda g: g[0])
+        self._soil_ids = np.array([g[0] for g in profile_groups], dtype=np.int64)
+
+        profiles = [p for _, ps in profile_groups for p in ps]
+        self._group_starts = np.cumsum([0] + [len(ps) for _, ps in profile_groups])
+        self._profile_ids = np.array([p["id"] for p in profiles], dtype=np.int64)
+        self._avg_percentages = np.array(
+            [p["avg_range_percentage_in_group"] for p in profiles], dtype=np.float64
+        )
+        self._range_percentages = _column(
+            [p["range_percentage_in_group"] for p in profiles]
+        )
+
+        layers = [layer for p in profiles for layer in p["layers"]]
+        self._profile_starts = np.cumsum([0] + [len(p["layers"]) for p in profiles])
+        self._columns = {}
+        for name in dict.fromkeys(name for layer in layers for name in layer):
+            is_set = np.array([name in layer for layer in layers], dtype=bool)
+            values = [layer[name] for layer in layers if name in layer]
+            column = _column(values)
+            full = np.zeros(len(layers), dtype=column.dtype)
+            full[is_set] = column
+            self._columns[name] = (full, is_set)
+
+    @classmethod
+    def from_db(cls, con, only_raw_data):
+        """load all profile groups of the soil database"""
+        return cls(
+            soil_io.get_soil_profile_group(
+                con, only_raw_data=only_raw_data, no_units=True
+            )
+        )
+
+    def __len__(self):
+        return len(self._soil_ids)
+
+    def __contains__(self, soil_id):
+        i = np.searchsorted(self._soil_ids, soil_id)
+        return i < len(self._soil_ids) and self._soil_ids[i] == soil_id
+
+    @property
+    def soil_ids(self):
+        return self._soil_ids
+
+    def profile_group(self, soil_id):
+        """Return the profile group of soil_id in the same form as soil_io does
+        (soil_id, list of profiles with layers as dicts), built from the column slices.
+        A soil id not in the database has no profiles."""
+        if soil_id not in self:
+            return int(soil_id), []
+        i = int(np.searchsorted(self._soil_ids, soil_id))
+
+        profiles = []
+        for p in range(self._group_starts[i], self._group_starts[i + 1]):
+            start, end = self._profile_starts[p], self._profile_starts[p + 1]
+            layers = [{} for _ in range(end - start)]
+            for name, (column, is_set) in self._columns.items():
+                for layer, value, set_ in zip(
+                    layers, column[start:end].tolist(), is_set[start:end].tolist()
+                ):
+                    if set_:
+                        layer[name] = value
+            profiles.append(
+                {
+                    "id": int(self._profile_ids[p]),
+                    "layers": layers,
+                    "range_percentage_in_group": self._range_percentages[
+                        p : p + 1
+                    ].tolist()[0],
+                    "avg_range_percentage_in_group": float(self._avg_percentages[p]),
+                }
+            )
+        return int(soil_id), profiles
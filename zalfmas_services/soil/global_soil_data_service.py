@@ -0,0 +1,300 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import asyncio
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import capnp
+import numpy as np
+from zalfmas_capnp_schemas_with_stubs import soil_capnp
+from zalfmas_common import common
+from zalfmas_common import service as serv
+
+from zalfmas_services import lru_cache
+from zalfmas_services.soil.global_soil_dataset import GlobalSoilDataSet
+from zalfmas_services.soil.sqlite_soil_data_service import (
+    CAPNP_PROP_to_MONICA_PARAM_NAME,
+    Profile,
+    Stream,
+)
+
+# the soil properties of the dataset, there is no derived data
+AVAILABLE_PARAMS = {
+    "mandatory": ["sand", "clay", "organicCarbon", "bulkDensity"],
+    "optional": [],
+}
+
+
+class Service(
+    soil_capnp.Service.Server,
+    common.Identifiable,
+    common.Persistable,
+    serv.AdministrableService,
+):
+    """Serve soil profiles of the Global Soil Dataset for Earth System Modeling (GSDE),
+    one profile per cell of the lat/lon grid."""
+
+    def __init__(
+        self,
+        path_to_soil_dir,
+        resolution="5min",
+        id=None,
+        name=None,
+        description=None,
+        admin=None,
+        restorer=None,
+        cache_max_entries=10000,
+        cache_max_bytes=256 * 1024 * 1024,
+        stream_tile_size=128,
+        stream_prefetch=1000,
+    ):
+        common.Identifiable.__init__(self, id, name, description)
+        common.Persistable.__init__(self, restorer)
+        serv.AdministrableService.__init__(self, admin)
+
+        self._dataset = GlobalSoilDataSet(path_to_soil_dir, resolution)
+        # the netcdf library can't be used from multiple threads at once,
+        # so reads not served from the cache run on a single executor thread
+        # and streams (running on their own worker threads) share the lock
+        self._read_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self._id = str(id if id else uuid.uuid4())
+        self._name = name if name else f"GSDE {resolution}"
+        self._description = description if description else ""
+        # ready built ProfileData messages by (row, col, avail_props)
+        self._cache_profile_datas = lru_cache.LRUCache(
+            cache_max_entries,
+            cache_max_bytes,
+            sizeof=lambda id_datas: sum(
+                len(id) + data.total_size.word_count * 8 for id, data in id_datas
+            ),
+        )
+
+        # rows and cols of the tiles read at once while streaming
+        self._stream_tile_size = stream_tile_size
+        # number of profiles a stream prepares ahead of the requested pages
+        self._stream_prefetch = stream_prefetch
+
+        self._capnp_prop_to_monica_param_name = CAPNP_PROP_to_MONICA_PARAM_NAME
+
+    def check_params_are_available(self, mandatory, optional):
+        aps = AVAILABLE_PARAMS
+        avail_mandatory = list(filter(lambda p: p in aps["mandatory"], mandatory))
+        avail_optional = list(
+            filter(lambda p: p in aps["mandatory"] or p in aps["optional"], optional)
+        )
+        failed = len(avail_mandatory) < len(mandatory)
+
+        return {
+            "failed": failed,
+            "mandatory": avail_mandatory,
+            "optional": avail_optional,
+        }
+
+    async def checkAvailableParameters_context(self, context):
+        # checkAvailableParameters @2 Query -> Query.Result;
+
+        p = context.params
+        r = context.results
+
+        avail = self.check_params_are_available(p.mandatory, p.optional)
+        r.mandatory = avail["mandatory"]
+        r.optional = avail["optional"]
+        r.failed = avail["failed"]
+
+    async def getAllAvailableParameters_context(self, context):
+        # getAllAvailableParameters @3 () -> (mandatory :List(PropertyName), optional :List(PropertyName));
+
+        r = context.results
+        r.mandatory = AVAILABLE_PARAMS["mandatory"]
+        r.optional = AVAILABLE_PARAMS["optional"]
+
+    def available_properties(self, mandatory, optional):
+        """Get all the names of the parameters requested in the query.
+        If a mandatory param is not available return no names, to indicate failure."""
+        res = self.check_params_are_available(mandatory, optional)
+        if res["failed"]:
+            return []
+        return res["mandatory"] + res["optional"]
+
+    @property
+    def cache_stats(self):
+        """entries, estimated bytes and hit ratio of the profile cache"""
+        return self._cache_profile_datas.stats()
+
+    def create_profile_data(self, layers, avail_props):
+        """create the ProfileData message of the layers as created by the dataset"""
+        profile_data = soil_capnp.ProfileData.new_message()
+        profile_data.percentageOfArea = 100.0
+        profile_data.init("layers", len(layers))
+        for k, layer in enumerate(layers):
+            l = profile_data.layers[k]
+            l.size = layer["Thickness"][0]
+            props = l.init("properties", len(avail_props))
+            for i, prop in enumerate(avail_props):
+                props[i].name = prop
+                value = layer[self._capnp_prop_to_monica_param_name[prop]][0]
+                if prop == "sand" or prop == "clay":
+                    props[i].f32Value = value * 100.0
+                else:
+                    props[i].f32Value = value
+        return profile_data.as_reader()
+
+    def profile_datas(self, row, col, avail_props):
+        """Return the id and ready built ProfileData message of the profile at row/col
+        as list (empty if there is no profile at the cell), the lists are cached."""
+        key = (row, col, tuple(avail_props))
+        profile_datas = self._cache_profile_datas.get(key)
+        if profile_datas is not None:
+            return profile_datas
+
+        with self._read_lock:
+            layers = self._dataset.create_soil_profile(row, col)
+        profile_datas = (
+            [(f"{row}_{col}", self.create_profile_data(layers, avail_props))]
+            if layers
+            else []
+        )
+        self._cache_profile_datas.put(key, profile_datas)
+        return profile_datas
+
+    async def load_profile_datas(self, row, col, avail_props):
+        """return the profile datas at row/col, reading them on the executor thread if
+        they aren't cached"""
+        key = (row, col, tuple(avail_props))
+        if key in self._cache_profile_datas:
+            return self.profile_datas(row, col, avail_props)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.profile_datas, row, col, avail_props
+        )
+
+    async def closestProfilesAt_context(self, context):
+        # closestProfilesAt @0 (coord :Geo.LatLonCoord, query :Query) -> (profiles :List(Profile));
+
+        query = context.params.query
+        coord = context.params.coord
+        avail_props = self.available_properties(query.mandatory, query.optional)
+        row, col = map(int, self._dataset.row_col_at(coord.lat, coord.lon))
+        if len(avail_props) == 0 or row < 0:
+            context.results.profiles = []
+            return
+
+        context.results.profiles = [
+            Profile(profile_data, coord.lat, coord.lon, id=id, restorer=self.restorer)
+            for id, profile_data in await self.load_profile_datas(row, col, avail_props)
+        ]
+
+    async def closest_profiles_at(self, latlon_coords, mandatory, optional):
+        """Batched variant of closestProfilesAt for many coordinates and one query.
+        latlon_coords is a list of Geo.LatLonCoord (or anything with lat and lon).
+        The rows/cols of all coordinates are computed at once and the profile of every
+        distinct cell is read only once.
+        Returns the list of profiles for every coordinate."""
+        avail_props = self.available_properties(mandatory, optional)
+        no_of_coords = len(latlon_coords)
+        if len(avail_props) == 0 or no_of_coords == 0:
+            return [[] for _ in range(no_of_coords)]
+
+        lats = np.fromiter((c.lat for c in latlon_coords), float, count=no_of_coords)
+        lons = np.fromiter((c.lon for c in latlon_coords), float, count=no_of_coords)
+        rows, cols = self._dataset.row_col_at(lats, lons)
+        rows_cols = list(zip(rows.tolist(), cols.tolist()))
+
+        profile_datas = {}
+        for row, col in dict.fromkeys(rows_cols):
+            profile_datas[(row, col)] = (
+                await self.load_profile_datas(row, col, avail_props) if row >= 0 else []
+            )
+
+        return [
+            [
+                Profile(profile_data, lat, lon, id=id, restorer=self.restorer)
+                for id, profile_data in profile_datas[row_col]
+            ]
+            for row_col, lat, lon in zip(rows_cols, lats.tolist(), lons.tolist())
+        ]
+
+    def _create_profiles(self, avail_props):
+        """Generate the stream items of all cells with a profile, tile by tile.
+        Every tile is read at once per soil variable, the profiles aren't cached."""
+        if len(avail_props) == 0:
+            return
+        nrows, ncols = self._dataset.shape
+        size = self._stream_tile_size
+        lats, lons = self._dataset.lats.tolist(), self._dataset.lons.tolist()
+        for top in range(0, nrows, size):
+            for left in range(0, ncols, size):
+                with self._read_lock:
+                    profiles = list(
+                        self._dataset.create_soil_profiles_in(
+                            top,
+                            min(top + size, nrows) - 1,
+                            left,
+                            min(left + size, ncols) - 1,
+                        )
+                    )
+                for row, col, layers in profiles:
+                    yield (
+                        f"{row}_{col}",
+                        self.create_profile_data(layers, avail_props),
+                        lats[row],
+                        lons[col],
+                    )
+
+    async def streamAllProfiles_context(self, context):
+        # streamAllProfiles @3 Query -> (allProfiles :Stream);
+
+        ps = context.params
+        avail_props = self.available_properties(ps.mandatory, ps.optional)
+        context.results.allProfiles = Stream(
+            self._create_profiles(avail_props),
+            restorer=self.restorer,
+            prefetch=self._stream_prefetch,
+        )
+
+
+async def main():
+    parser = serv.create_default_args_parser("Global Soil Data Service")
+    config, _ = serv.handle_default_service_args(parser, path_to_service_py=__file__)
+
+    cs = config["service"]
+
+    if "path_to_soil_dir" not in cs:
+        print("No path to soil dir given.")
+        exit(0)
+
+    restorer = common.Restorer()
+    service = Service(
+        path_to_soil_dir=cs["path_to_soil_dir"],
+        resolution=cs.get("resolution", "5min"),
+        id=cs.get("id", None),
+        name=cs.get("name"),
+        description=cs.get("description"),
+        restorer=restorer,
+        cache_max_entries=cs.get("cache_max_entries", 10000),
+        cache_max_bytes=cs.get("cache_max_bytes", 256 * 1024 * 1024),
+        stream_tile_size=cs.get("stream_tile_size", 128),
+        stream_prefetch=cs.get("stream_prefetch", 1000),
+    )
+    await serv.init_and_run_service_from_config(
+        config=config, service=service, restorer=restorer
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(capnp.run(main()))
@@ -13,15 +13,31 @@
 #
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
-from netCDF4 import Dataset
+import sys
+
 import numpy as np
+from netCDF4 import Dataset
+
+from zalfmas_services.soil import gsde_arrays
+
+
+def _layer_depths(arrays):
+    """Return the index of the last layer of the profiles in the masked (layers, ...)
+    arrays of the soil variables. A profile ends before the first layer where any soil
+    variable is masked, the result is -1 if already the first layer is masked."""
+    masked = None
+    for array in arrays:
+        mask = np.ma.getmaskarray(array)
+        masked = mask if masked is None else masked | mask
+    return np.where(masked.any(axis=0), masked.argmax(axis=0), len(masked)) - 1
 
 
 class GlobalSoilDataSet:
     """Global Soil Dataset for Earth System Modeling"""
 
-    def __init__(self, path_to_soil_dir, resolution):
-        # open netcdfs
+    def __init__(self, path_to_soil_dir, resolution, use_converted=True):
+        """If use_converted and the netcdfs have been converted (see convert),
+        the profiles are served from the memory mapped converted arrays instead."""
         path_to_soil_netcdfs = path_to_soil_dir + "/" + resolution + "/"
         if resolution == "5min":
             self.soil_data = {
@@ -50,31 +66,138 @@ class GlobalSoilDataSet:
             self.soil_data = (
                 None  # ["Sand5min.nc", "Clay5min.nc", "OC5min.nc", "BD5min.nc"]
             )
+        self._path_to_soil_netcdfs = path_to_soil_netcdfs
+        self._resolution = resolution
+        self._files = [data["file"] for data in self.soil_data.values()]
+        self._converted = (
+            gsde_arrays.load_converted(path_to_soil_netcdfs, resolution, self._files)
+            if use_converted
+            else None
+        )
+
         self.soil_datasets = {}
         self.soil_vars = {}
-        for elem, data in self.soil_data.items():
-            ds = Dataset(path_to_soil_netcdfs + data["file"], "r", format="NETCDF4")
-            self.soil_datasets[elem] = ds
-            self.soil_vars[elem] = ds.variables[data["var"]]
+        if self._converted is not None:
+            self.lats = self._converted["lats"]
+            self.lons = self._converted["lons"]
+        else:
+            # open netcdfs
+            for elem, data in self.soil_data.items():
+                ds = Dataset(path_to_soil_netcdfs + data["file"], "r", format="NETCDF4")
+                self.soil_datasets[elem] = ds
+                self.soil_vars[elem] = ds.variables[data["var"]]
+
+            # cell centers of the regular lat/lon grid (the same for all soil
+            # variables), lat might be in descending order
+            ds = next(iter(self.soil_datasets.values()))
+            self.lats = np.asarray(ds.variables["lat"][:], dtype=np.float64)
+            self.lons = np.asarray(ds.variables["lon"][:], dtype=np.float64)
+        self.shape = (len(self.lats), len(self.lons))
+        self._lat_step = (self.lats[-1] - self.lats[0]) / (len(self.lats) - 1)
+        self._lon_step = (self.lons[-1] - self.lons[0]) / (len(self.lons) - 1)
+
+    def row_col_at(self, lats, lons):
+        """Compute the rows and cols of the cells containing the lat/lon coordinates
+        (scalars or arrays) from the grid geometry. Coordinates outside of the grid get
+        row and col -1."""
+        rows = np.floor(
+            (np.asarray(lats) - self.lats[0]) / self._lat_step + 0.5
+        ).astype(np.int64)
+        cols = np.floor(
+            (np.asarray(lons) - self.lons[0]) / self._lon_step + 0.5
+        ).astype(np.int64)
+        outside = (
+            (rows < 0) | (rows >= self.shape[0]) | (cols < 0) | (cols >= self.shape[1])
+        )
+        return np.where(outside, -1, rows), np.where(outside, -1, cols)
+
+    def read_columns(self, row, col):
+        """read the full depth column of every soil variable at row/col at once"""
+        return {elem: var[:8, row, col] for elem, var in self.soil_vars.items()}
+
+    def read_block(self, top, bottom, left, right):
+        """Read the full depth of every soil variable for the rows top to bottom and
+        cols left to right (inclusive) at once.
+        The returned masked arrays are shaped (layers, rows, cols)."""
+        return {
+            elem: var[:8, top : bottom + 1, left : right + 1]
+            for elem, var in self.soil_vars.items()
+        }
+
+    def layer_depths_and_values_in(self, top, bottom, left, right):
+        """Read the block of rows top to bottom and cols left to right (inclusive) from
+        the netcdfs. Returns the index of the last layer of the profile of every cell
+        (rows, cols) and the converted values of the soil variables
+        (layers, rows, cols)."""
+        block = self.read_block(top, bottom, left, right)
+        values = {
+            elem: np.ma.getdata(block[elem]) * self.soil_data[elem]["conv_factor"]
+            for elem in gsde_arrays.PROPS
+        }
+        return _layer_depths(block.values()), values
 
     def create_soil_profile(self, row, col):
-        # skip first 4.5cm layer and just use 7 layers
-        layers = []
+        if self._converted is not None:
+            i = int(self._converted["cell_index"][row, col])
+            if i < 0:
+                return None
+            return self.layers(
+                dict(zip(gsde_arrays.PROPS, self._converted["profiles"][i].T.tolist())),
+                int(self._converted["depths"][i]),
+            )
+        return self.soil_profile_from_columns(self.read_columns(row, col))
+
+    def create_soil_profiles_in(self, top, bottom, left, right):
+        """Create the soil profiles of all cells in the rows top to bottom and cols left
+        to right (inclusive) from a single block read per soil variable.
+        Cells without a profile (e.g. sea) are skipped, their depths are found for the
+        whole block at once. Yields (row, col, profile) in row major order."""
+        if self._converted is not None:
+            cell_index = self._converted["cell_index"][
+                top : bottom + 1, left : right + 1
+            ]
+            rows, cols = np.nonzero(cell_index >= 0)
+            indices = cell_index[rows, cols]
+            profiles = self._converted["profiles"][indices]
+            depths = self._converted["depths"][indices].tolist()
+            for r, c, profile, depth in zip(
+                rows.tolist(), cols.tolist(), profiles, depths
+            ):
+                yield (
+                    top + r,
+                    left + c,
+                    self.layers(
+                        dict(zip(gsde_arrays.PROPS, profile.T.tolist())), depth
+                    ),
+                )
+            return
 
-        layer_depth = 8
-        # find the fill value for the soil data
-        for elem2 in self.soil_data.keys():
-            for i in range(8):
-                if np.ma.is_masked(self.soil_vars[elem2][i, row, col]):
-                    if i < layer_depth:
-                        layer_depth = i
-                    break
-                    # return None
-        layer_depth -= 1
+        layer_depths, values = self.layer_depths_and_values_in(top, bottom, left, right)
+        rows, cols = np.nonzero(layer_depths >= 4)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            columns = {elem: v[:, r, c].tolist() for elem, v in values.items()}
+            yield top + r, left + c, self.layers(columns, int(layer_depths[r, c]))
 
+    def soil_profile_from_columns(self, columns):
+        """Create the soil profile from the depth columns (masked arrays) of the soil
+        variables, as returned by read_columns."""
+        layer_depth = int(_layer_depths(columns.values()))
         if layer_depth < 4:
             return None
 
+        values = {
+            elem: (
+                np.ma.getdata(columns[elem]) * self.soil_data[elem]["conv_factor"]
+            ).tolist()
+            for elem in gsde_arrays.PROPS
+        }
+        return self.layers(values, layer_depth)
+
+    def layers(self, values, layer_depth):
+        """Create the layers from the converted values (per soil variable a list over
+        the layers) down to layer_depth (last layer index)."""
+        # skip first 4.5cm layer and just use 7 layers
+        layers = []
         for i, real_depth_cm, monica_depth_m in [
             (0, 4.5, 0),
             (1, 9.1, 0.1),
@@ -89,26 +212,53 @@ class GlobalSoilDataSet:
                 layers.append(
                     {
                         "Thickness": [monica_depth_m, "m"],
-                        "SoilOrganicCarbon": [
-                            self.soil_vars["corg"][i, row, col]
-                            * self.soil_data["corg"]["conv_factor"],
-                            "%",
-                        ],
-                        "SoilBulkDensity": [
-                            self.soil_vars["bd"][i, row, col]
-                            * self.soil_data["bd"]["conv_factor"],
-                            "kg m-3",
-                        ],
-                        "Sand": [
-                            self.soil_vars["sand"][i, row, col]
-                            * self.soil_data["sand"]["conv_factor"],
-                            "fraction",
-                        ],
-                        "Clay": [
-                            self.soil_vars["clay"][i, row, col]
-                            * self.soil_data["clay"]["conv_factor"],
-                            "fraction",
-                        ],
+                        "SoilOrganicCarbon": [values["corg"][i], "%"],
+                        "SoilBulkDensity": [values["bd"][i], "kg m-3"],
+                        "Sand": [values["sand"][i], "fraction"],
+                        "Clay": [values["clay"][i], "fraction"],
                     }
                 )
         return layers
+
+    def convert(self, rows_per_chunk=256):
+        """Convert the netcdf files into the memory mappable arrays used instead of
+        the netcdfs from then on (until the netcdfs change).
+        Returns the number of converted profiles."""
+        if self._converted is not None:
+            raise ValueError("the dataset has been loaded from the converted arrays")
+        return gsde_arrays.convert(
+            self,
+            self._path_to_soil_netcdfs,
+            self._resolution,
+            self._files,
+            rows_per_chunk=rows_per_chunk,
+        )
+
+
+def main():
+    config = {
+        "path_to_soil_dir": None,
+        "resolution": "5min",
+        "rows_per_chunk": "256",
+    }
+    # read commandline args only if script is invoked directly from commandline
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+    print("config used:", config)
+
+    if not config["path_to_soil_dir"]:
+        print("No path to soil dir given.")
+        exit(0)
+
+    dataset = GlobalSoilDataSet(
+        config["path_to_soil_dir"], config["resolution"], use_converted=False
+    )
+    no_of_profiles = dataset.convert(rows_per_chunk=int(config["rows_per_chunk"]))
+    print("Converted", no_of_profiles, "profiles.")
+
+
+if __name__ == "__main__":
+    main()
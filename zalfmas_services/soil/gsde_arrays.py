@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+
+import numpy as np
+
+from zalfmas_services import sidecar_cache
+
+# the order of the soil variables along the last axis of the profiles array
+PROPS = ("corg", "bd", "sand", "clay")
+
+
+def converted_paths(path_to_soil_netcdfs, resolution):
+    """return the paths to the profiles, layer depths and cell index arrays and the json
+    header of the converted dataset next to the netcdf files"""
+    base = os.path.join(path_to_soil_netcdfs, f"gsde_{resolution}")
+    return (
+        base + ".profiles.npy",
+        base + ".depths.npy",
+        base + ".cell_index.npy",
+        base + ".json",
+    )
+
+
+def _source_paths(path_to_soil_netcdfs, files):
+    return [os.path.join(path_to_soil_netcdfs, file) for file in files]
+
+
+def load_converted(path_to_soil_netcdfs, resolution, files):
+    """Load the converted dataset, if it is still valid for the netcdf files.
+    The arrays are memory mapped read-only. Returns a dict with the profiles
+    (cells, layers, props) float32, the index of the last layer of every profile
+    (cells) int8, the cell index (rows, cols) int32 (-1 for cells without profile)
+    and the lats and lons of the cell centers or None."""
+    *paths, path_to_header = converted_paths(path_to_soil_netcdfs, resolution)
+    header = sidecar_cache.load_header(
+        path_to_header, _source_paths(path_to_soil_netcdfs, files), props=list(PROPS)
+    )
+    if header is None:
+        return None
+    try:
+        profiles, depths, cell_index = [np.load(p, mmap_mode="r") for p in paths]
+    except (OSError, ValueError):
+        return None
+    return {
+        "profiles": profiles,
+        "depths": depths,
+        "cell_index": cell_index,
+        "lats": np.array(header["lats"], dtype=np.float64),
+        "lons": np.array(header["lons"], dtype=np.float64),
+    }
+
+
+def convert(dataset, path_to_soil_netcdfs, resolution, files, rows_per_chunk=256):
+    """Convert the netcdf files of the dataset (a GlobalSoilDataSet reading the netcdfs)
+    into the arrays loaded by load_converted.
+    The grid is processed in chunks of whole rows, aligned to the chunking of the netcdf
+    variables. A first pass finds the cells with a profile, a second one writes their
+    converted values into the memory mapped profiles array, so only one chunk is held
+    in memory at a time. Returns the number of profiles."""
+    nrows, ncols = dataset.shape
+    chunk_rows = [
+        var.chunking()[1]
+        for var in dataset.soil_vars.values()
+        if var.chunking() != "contiguous"
+    ]
+    if chunk_rows:
+        step = max(chunk_rows)
+        rows_per_chunk = max(rows_per_chunk // step, 1) * step
+    chunks = [
+        (top, min(top + rows_per_chunk, nrows) - 1)
+        for top in range(0, nrows, rows_per_chunk)
+    ]
+
+    cell_index = np.full((nrows, ncols), -1, dtype=np.int32)
+    for top, bottom in chunks:
+        layer_depths, _ = dataset.layer_depths_and_values_in(top, bottom, 0, ncols - 1)
+        cell_index[top : bottom + 1][layer_depths >= 4] = 0
+    has_profile = cell_index >= 0
+    no_of_profiles = int(np.count_nonzero(has_profile))
+    cell_index[has_profile] = np.arange(no_of_profiles, dtype=np.int32)
+
+    *paths, path_to_header = converted_paths(path_to_soil_netcdfs, resolution)
+    sidecar_cache.remove_header(path_to_header)
+    # the profile and depth arrays are written via memory maps of temporary files
+    tmp_paths = [sidecar_cache.tmp_path(p) for p in paths[:2]]
+    profiles = np.lib.format.open_memmap(
+        tmp_paths[0], mode="w+", dtype=np.float32, shape=(no_of_profiles, 8, len(PROPS))
+    )
+    depths = np.lib.format.open_memmap(
+        tmp_paths[1], mode="w+", dtype=np.int8, shape=(no_of_profiles,)
+    )
+    for top, bottom in chunks:
+        layer_depths, values = dataset.layer_depths_and_values_in(
+            top, bottom, 0, ncols - 1
+        )
+        rows, cols = np.nonzero(layer_depths >= 4)
+        if len(rows) == 0:
+            continue
+        start = cell_index[top + rows[0], cols[0]]
+        end = start + len(rows)
+        depths[start:end] = layer_depths[rows, cols]
+        for p, prop in enumerate(PROPS):
+            profiles[start:end, :, p] = values[prop][:, rows, cols].T
+    profiles.flush()
+    depths.flush()
+    del profiles, depths
+    for tmp_path, path in zip(tmp_paths, paths):
+        os.replace(tmp_path, path)
+    sidecar_cache.write_file(paths[2], lambda _: np.save(_, cell_index))
+
+    header = sidecar_cache.source_key(
+        _source_paths(path_to_soil_netcdfs, files), props=list(PROPS)
+    )
+    header["shape"] = [nrows, ncols]
+    header["no_of_profiles"] = no_of_profiles
+    header["lats"] = dataset.lats.tolist()
+    header["lons"] = dataset.lons.tolist()
+    sidecar_cache.write_header(path_to_header, header)
+    return no_of_profiles
@@ -14,20 +14,29 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import asyncio
+import queue
 import sqlite3
+import threading
 
 # import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
 import capnp
-from pyproj import CRS
+import numpy as np
+from pyproj import CRS, Transformer
 from zalfmas_capnp_schemas_with_stubs import soil_capnp
 from zalfmas_common import common, geo
-from zalfmas_common import rect_ascii_grid_management as grid_man
 from zalfmas_common import service as serv
 from zalfmas_common.soil import soil_io
 
+from zalfmas_services import lru_cache
+from zalfmas_services.grid import grid_cache, grid_index
+from zalfmas_services.soil import warm_cache
+from zalfmas_services.soil.columnar_soil_store import ColumnarSoilStore
+
 
 def set_capnp_prop_name_via_monica_name(param, name, value=None):
     """set the correct union parameter in capnp Parameters struct object
@@ -101,6 +110,36 @@ CAPNP_PROP_to_MONICA_PARAM_NAME = {
 }
 
 
+class ReadOnlyConnectionPool:
+    """A fixed number of read-only connections to an sqlite database, which can be used
+    from any thread (one thread per connection at a time).
+    The database is opened as immutable, so it must not be changed while in use."""
+
+    def __init__(self, path_to_sqlite_db, size=4, mmap_size=256 * 1024 * 1024):
+        self._uri = (
+            Path(path_to_sqlite_db).resolve().as_uri()
+            + "?mode=ro&immutable=1&cache=shared"
+        )
+        self._mmap_size = mmap_size
+        self._connections = queue.Queue()
+        for _ in range(max(size, 1)):
+            self._connections.put(self._connect())
+
+    def _connect(self):
+        con = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        con.execute(f"PRAGMA mmap_size={int(self._mmap_size)}")
+        return con
+
+    @contextmanager
+    def connection(self):
+        """borrow a connection from the pool, waits until one is available"""
+        con = self._connections.get()
+        try:
+            yield con
+        finally:
+            self._connections.put(con)
+
+
 class Profile(soil_capnp.Profile.Server, common.Identifiable, common.Persistable):
     def __init__(
         self, data, lat, lon, id=None, name=None, description=None, restorer=None
@@ -146,6 +185,14 @@ class Service(
         description=None,
         admin=None,
         restorer=None,
+        pool_size=4,
+        mmap_size=256 * 1024 * 1024,
+        columnar_store=False,
+        cache_max_entries=10000,
+        cache_max_bytes=256 * 1024 * 1024,
+        profile_cache_max_entries=10000,
+        profile_cache_max_bytes=256 * 1024 * 1024,
+        stream_prefetch=1000,
     ):
         common.Identifiable.__init__(self, id, name, description)
         common.Persistable.__init__(self, restorer)
@@ -153,55 +200,214 @@ class Service(
 
         self._path_to_sqlite_db = path_to_sqlite_db
         self._path_to_ascii_grid = path_to_ascii_grid
-        self._con = sqlite3.connect(self._path_to_sqlite_db)
+        # database lookups not served from the caches run on the executor threads,
+        # so they don't block the event loop
+        self._pool = ReadOnlyConnectionPool(
+            self._path_to_sqlite_db, size=pool_size, mmap_size=mmap_size
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max(pool_size, 1))
         self._grid_crs = grid_crs
+        self._latlon_to_grid_crs = Transformer.from_crs(
+            CRS.from_epsg(4326), self._grid_crs, always_xy=True
+        )
+        self._grid_crs_to_latlon = Transformer.from_crs(
+            self._grid_crs, CRS.from_epsg(4326), always_xy=True
+        )
 
         self._all_available_params_raw = None
         self._all_available_params_derived = None
 
-        self._interpol_and_latlon_coords = None
+        self._grid_and_index = None
+        self._interpolator = None
+        self._all_latlon_coords = None
+        self._distinct_soil_ids_and_cell_index = None
 
         self._id = str(id if id else uuid.uuid4())
         self._name = name if name else self._path_to_sqlite_db
         self._description = description if description else ""
-        self._cache_raw = {}
-        self._cache_derived = {}
+        # profile groups read from the database by soil_id
+        self._cache_raw = lru_cache.LRUCache(
+            cache_max_entries, cache_max_bytes, sizeof=lru_cache.deep_sizeof
+        )
+        self._cache_derived = lru_cache.LRUCache(
+            cache_max_entries, cache_max_bytes, sizeof=lru_cache.deep_sizeof
+        )
+        # ready built ProfileData messages by (soil_id, avail_props, only_raw_data)
+        self._cache_profile_datas = lru_cache.LRUCache(
+            profile_cache_max_entries,
+            profile_cache_max_bytes,
+            sizeof=lambda id_datas: sum(
+                len(id) + data.total_size.word_count * 8 for id, data in id_datas
+            ),
+        )
+
+        # number of profiles prepared ahead of the requested pages of a stream
+        self._stream_prefetch = stream_prefetch
+
+        # optionally all profile groups (raw and derived) held column wise in memory,
+        # then the database isn't queried for profiles anymore
+        self._stores = None
+        if columnar_store:
+            with self._pool.connection() as con:
+                self._stores = {
+                    only_raw_data: ColumnarSoilStore.from_db(con, only_raw_data)
+                    for only_raw_data in (True, False)
+                }
 
         self._capnp_prop_to_monica_param_name = CAPNP_PROP_to_MONICA_PARAM_NAME
         self._monica_param_to_capnp_prop_name = {
             value: key for key, value in CAPNP_PROP_to_MONICA_PARAM_NAME.items()
         }
 
+    def _load_grid_and_index(self, valid_rows_cols=None):
+        grid, metadata = grid_cache.load_grid_and_metadata_from_ascii_grid(
+            self._path_to_ascii_grid, datatype=int
+        )
+        return grid, grid_index.RectGridIndex(grid, metadata, valid_rows_cols)
+
     @property
-    def interpol_and_latlon_coords(self):
-        # create interpolator
-        if not self._interpol_and_latlon_coords:
-            rect_interpol, points_to_value = (
-                grid_man.create_interpolator_from_ascii_grid(self._path_to_ascii_grid)
-            )
-            latlon_interpol = grid_man.interpolate_from_latlon(
-                rect_interpol, self._grid_crs
+    def grid_and_index(self):
+        # load soil id grid and create row/col index
+        if not self._grid_and_index:
+            self._grid_and_index = self._load_grid_and_index()
+        return self._grid_and_index
+
+    def _create_interpolator(self):
+        grid, index = self.grid_and_index
+
+        def latlon_interpol(lat, lon):
+            r, h = self._latlon_to_grid_crs.transform(lon, lat)
+            row, col = index.row_col_at(r, h, ignore_nodata=True)
+            return grid[row, col]
+
+        return latlon_interpol
+
+    def valid_cell_positions_in(self, top, bottom, left, right):
+        """return the positions (in the row-major order of all valid cells) of the valid
+        cells in the window from top to bottom and left to right (inclusive)"""
+        _, index = self.grid_and_index
+        valid_rows, valid_cols = index.valid_rows_cols
+        row_range = np.arange(top, bottom + 1)
+        row_starts = np.searchsorted(valid_rows, row_range, side="left")
+        row_ends = np.searchsorted(valid_rows, row_range, side="right")
+        positions = []
+        for start, end in zip(row_starts.tolist(), row_ends.tolist()):
+            cols = valid_cols[start:end]
+            positions.append(
+                np.arange(
+                    start + np.searchsorted(cols, left, side="left"),
+                    start + np.searchsorted(cols, right, side="right"),
+                )
             )
-            all_latlon_coords = grid_man.rect_coordinates_to_latlon(
-                self._grid_crs, points_to_value.keys()
+        return np.concatenate(positions) if positions else np.empty(0, np.int64)
+
+    def iter_latlon_coords(self, chunk_size=100000, windows=None):
+        """Generate the rows, cols, lats and lons of the centers of all valid cells
+        in row-major order, in chunks of chunk_size cells.
+        If windows, a list of (top, bottom, left, right) rows/cols (inclusive), are given,
+        only the cells in these windows (one after the other) are generated.
+        If the coordinates of all cells are cached already (see all_latlon_coords),
+        the chunks are read from there (in float32 precision), else every chunk is
+        transformed at once and only computed when needed."""
+        _, index = self.grid_and_index
+        all_latlon_coords = self._all_latlon_coords
+        if all_latlon_coords is not None:
+            valid_rows, valid_cols = index.valid_rows_cols
+            if windows is None:
+                parts = [None]
+            else:
+                parts = (self.valid_cell_positions_in(*window) for window in windows)
+            for positions in parts:
+                size = len(valid_rows) if positions is None else len(positions)
+                for start in range(0, size, chunk_size):
+                    ps = (
+                        slice(start, start + chunk_size)
+                        if positions is None
+                        else positions[start : start + chunk_size]
+                    )
+                    latlons = all_latlon_coords[ps].astype(np.float64)
+                    yield valid_rows[ps], valid_cols[ps], latlons[:, 0], latlons[:, 1]
+            return
+
+        if windows is None:
+            rows_cols = [index.valid_rows_cols]
+        else:
+            rows_cols = (index.valid_rows_cols_in(*window) for window in windows)
+        for valid_rows, valid_cols in rows_cols:
+            for start in range(0, len(valid_rows), chunk_size):
+                rows = valid_rows[start : start + chunk_size]
+                cols = valid_cols[start : start + chunk_size]
+                lons, lats = self._grid_crs_to_latlon.transform(
+                    *index.cell_centers(rows, cols)
+                )
+                yield rows, cols, np.asarray(lats), np.asarray(lons)
+
+    @property
+    def interpol_and_latlon_coords(self):
+        return self.interpolator, self.all_latlon_coords
+
+    def _warm_up(self):
+        """Load the soil grid index, the lat/lon coordinates of all cells and the available
+        parameters from the warm cache next to the database. If there is no valid cache,
+        create them and store them in the cache for the next start."""
+        cache = warm_cache.load_warm_cache(
+            self._path_to_sqlite_db, self._path_to_ascii_grid, self._grid_crs
+        )
+        if cache is not None:
+            self._grid_and_index = self._load_grid_and_index(
+                (cache["valid_rows"], cache["valid_cols"])
             )
-            self._interpol_and_latlon_coords = (latlon_interpol, all_latlon_coords)
-        return self._interpol_and_latlon_coords
+            self._interpolator = None
+            self._all_latlon_coords = cache["latlon"]
+            self._all_available_params_raw = cache["params_raw"]
+            self._all_available_params_derived = cache["params_derived"]
+            return
+
+        _, index = self.grid_and_index
+        valid_rows, valid_cols = index.valid_rows_cols
+        warm_cache.store_warm_cache(
+            self._path_to_sqlite_db,
+            self._path_to_ascii_grid,
+            self._grid_crs,
+            self.all_available_params_raw,
+            self.all_available_params_derived,
+            valid_rows,
+            valid_cols,
+            self.all_latlon_coords,
+        )
+
+    async def warm_up(self):
+        """run the warm up on an executor thread, so the service can be used meanwhile"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._warm_up)
 
     @property
     def interpolator(self):
-        return self.interpol_and_latlon_coords[0]
+        if not self._interpolator:
+            self._interpolator = self._create_interpolator()
+        return self._interpolator
 
     @property
     def all_latlon_coords(self):
-        return self.interpol_and_latlon_coords[1]
+        """the lat/lon coordinates of the centers of all valid cells in row-major order
+        as (cells, 2) float32 array, computed on first use"""
+        if self._all_latlon_coords is None:
+            _, index = self.grid_and_index
+            all_latlon_coords = np.empty((len(index.valid_rows_cols[0]), 2), np.float32)
+            start = 0
+            for _, _, lats, lons in self.iter_latlon_coords():
+                all_latlon_coords[start : start + len(lats), 0] = lats
+                all_latlon_coords[start : start + len(lats), 1] = lons
+                start += len(lats)
+            self._all_latlon_coords = all_latlon_coords
+        return self._all_latlon_coords
 
     @property
     def all_available_params_derived(self):
         if not self._all_available_params_derived:
-            params = soil_io.available_soil_parameters_group(
-                self._con, only_raw_data=False
-            )
+            with self._pool.connection() as con:
+                params = soil_io.available_soil_parameters_group(
+                    con, only_raw_data=False
+                )
             self._all_available_params_derived = {
                 "mandatory": list(
                     filter(
@@ -231,9 +437,10 @@ class Service(
     @property
     def all_available_params_raw(self):
         if self._all_available_params_raw is None:
-            params = soil_io.available_soil_parameters_group(
-                self._con, only_raw_data=True
-            )
+            with self._pool.connection() as con:
+                params = soil_io.available_soil_parameters_group(
+                    con, only_raw_data=True
+                )
             # print("params:", params)
             self._all_available_params_raw = {
                 "mandatory": list(
@@ -304,38 +511,74 @@ class Service(
         r.mandatory = aps["mandatory"]
         r.optional = aps["optional"]
 
-    def profiles_at(self, lat, lon, avail_props, only_raw_data):
-        if len(avail_props) > 0:
-            try:
-                soil_id = int(self.interpolator(lat, lon))
-            except:
-                return
-            cache = self._cache_raw if only_raw_data else self._cache_derived
-            if soil_id in cache:
-                sps = cache[soil_id]
-            else:
+    @property
+    def cache_stats(self):
+        """entries, estimated bytes and hit ratio of the profile group and profile caches"""
+        return {
+            "raw": self._cache_raw.stats(),
+            "derived": self._cache_derived.stats(),
+            "profile_datas": self._cache_profile_datas.stats(),
+        }
+
+    async def log_cache_stats(self, interval):
+        """print the cache stats every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            print(f"{self.name} cache stats:", self.cache_stats, flush=True)
+
+    def soil_profile_group(self, soil_id, only_raw_data):
+        """return the (cached) profile group of the soil_id as read from the database"""
+        if self._stores is not None:
+            return self._stores[only_raw_data].profile_group(soil_id)
+        cache = self._cache_raw if only_raw_data else self._cache_derived
+        sps = cache.get(soil_id)
+        if sps is None:
+            with self._pool.connection() as con:
                 sp_groups = soil_io.get_soil_profile_group(
-                    self._con, soil_id, only_raw_data=only_raw_data, no_units=True
+                    con, soil_id, only_raw_data=only_raw_data, no_units=True
                 )
-                # because of given soil_id we expect only one profile group (with potentially many profiles)
-                sps = sp_groups[0]
-                cache[soil_id] = sps
-        else:
-            return
+            # because of given soil_id we expect only one profile group (with potentially many profiles)
+            sps = sp_groups[0]
+            # soil_io returns an empty placeholder group if the soil_id isn't in the
+            # database, like the columnar store it has no profiles then
+            if sps[0] is None:
+                sps = (soil_id, [])
+            cache.put(soil_id, sps)
+        return sps
+
+    async def load_soil_profile_group(self, soil_id, avail_props, only_raw_data):
+        """Read the profile group of soil_id from the database on an executor thread,
+        if neither it nor the profiles are cached. Returns the read group, to be passed
+        on to profile_datas, or None if nothing had to be read."""
+        cache = self._cache_raw if only_raw_data else self._cache_derived
+        if (
+            self._stores is None
+            and (soil_id, tuple(avail_props), only_raw_data)
+            not in self._cache_profile_datas
+            and soil_id not in cache
+        ):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.soil_profile_group, soil_id, only_raw_data
+            )
+        return None
+
+    def profile_datas(self, soil_id, avail_props, only_raw_data, sps=None):
+        """Return the ids and ready built ProfileData messages of the profiles of soil_id,
+        sorted by their percentage of area (descending).
+        The messages are cached, as the order of avail_props is reflected in the messages
+        they are part of the key. sps is the profile group of soil_id, if it has just
+        been loaded, so it isn't looked up (and counted) in the cache a second time."""
+        key = (soil_id, tuple(avail_props), only_raw_data)
+        profile_datas = self._cache_profile_datas.get(key)
+        if profile_datas is not None:
+            return profile_datas
 
-        profiles = []  # results.init("profiles", len(sps[1]))
+        if sps is None:
+            sps = self.soil_profile_group(soil_id, only_raw_data)
+        profile_datas = []
         profile_group_id = sps[0]
         for j, sp in enumerate(sps[1]):
-            profile_data = soil_capnp.ProfileData.new_message()  # profiles[j]
-            profiles.append(
-                Profile(
-                    profile_data,
-                    lat,
-                    lon,
-                    id=str(profile_group_id) + "_" + str(sp["id"]),
-                    restorer=self.restorer,
-                )
-            )
+            profile_data = soil_capnp.ProfileData.new_message()
             profile_data.percentageOfArea = sp["avg_range_percentage_in_group"]
 
             layers = sp["layers"]
@@ -372,8 +615,39 @@ class Service(
                             else:
                                 props[i].f32Value = value
 
-        profiles.sort(key=lambda p: p.data.percentageOfArea, reverse=True)
-        return profiles
+            profile_datas.append(
+                (
+                    str(profile_group_id) + "_" + str(sp["id"]),
+                    profile_data.as_reader(),
+                )
+            )
+
+        profile_datas.sort(
+            key=lambda id_data: id_data[1].percentageOfArea, reverse=True
+        )
+        self._cache_profile_datas.put(key, profile_datas)
+        return profile_datas
+
+    def soil_id_at(self, lat, lon):
+        """return the soil id of the (valid) cell closest to lat/lon or None"""
+        try:
+            return int(self.interpolator(lat, lon))
+        except:
+            return None
+
+    def profiles_at(self, lat, lon, avail_props, only_raw_data, sps=None):
+        if len(avail_props) == 0:
+            return
+        soil_id = self.soil_id_at(lat, lon)
+        if soil_id is None:
+            return
+
+        return [
+            Profile(profile_data, lat, lon, id=id, restorer=self.restorer)
+            for id, profile_data in self.profile_datas(
+                soil_id, avail_props, only_raw_data, sps=sps
+            )
+        ]
 
     def available_properties(self, mandatory, optional, onlyRawData):
         """
@@ -396,42 +670,316 @@ class Service(
         avail_props = self.available_properties(
             query.mandatory, query.optional, query.onlyRawData
         )
+        soil_id = self.soil_id_at(coord.lat, coord.lon)
+        sps = None
+        if len(avail_props) > 0 and soil_id is not None:
+            sps = await self.load_soil_profile_group(
+                soil_id, avail_props, query.onlyRawData
+            )
         context.results.profiles = self.profiles_at(
-            coord.lat, coord.lon, avail_props, query.onlyRawData
+            coord.lat, coord.lon, avail_props, query.onlyRawData, sps=sps
+        )
+
+    def soil_ids_at(self, lats, lons):
+        """return the soil ids of the (valid) cells closest to the lat/lon coordinates"""
+        grid, index = self.grid_and_index
+        rs, hs = self._latlon_to_grid_crs.transform(lons, lats)
+        rows, cols = index.row_col_at(rs, hs, ignore_nodata=True)
+        return grid[rows, cols]
+
+    async def closest_profiles_at(
+        self, latlon_coords, mandatory, optional, only_raw_data
+    ):
+        """Batched variant of closestProfilesAt for many coordinates and one query.
+        latlon_coords is a list of Geo.LatLonCoord (or anything with lat and lon attributes).
+        All coordinates are transformed at once and the profiles of every distinct soil id
+        are built only once.
+        Returns the list of profiles for every coordinate."""
+        avail_props = self.available_properties(mandatory, optional, only_raw_data)
+        no_of_coords = len(latlon_coords)
+        if len(avail_props) == 0 or no_of_coords == 0:
+            return [[] for _ in range(no_of_coords)]
+
+        lats = np.fromiter((c.lat for c in latlon_coords), float, count=no_of_coords)
+        lons = np.fromiter((c.lon for c in latlon_coords), float, count=no_of_coords)
+        soil_ids = self.soil_ids_at(lats, lons).tolist()
+
+        distinct_soil_ids = list(dict.fromkeys(soil_ids))
+        loaded_sps = await asyncio.gather(
+            *[
+                self.load_soil_profile_group(soil_id, avail_props, only_raw_data)
+                for soil_id in distinct_soil_ids
+            ]
         )
+        profile_datas = {
+            soil_id: self.profile_datas(soil_id, avail_props, only_raw_data, sps=sps)
+            for soil_id, sps in zip(distinct_soil_ids, loaded_sps)
+        }
+
+        return [
+            [
+                Profile(profile_data, lat, lon, id=id, restorer=self.restorer)
+                for id, profile_data in profile_datas[soil_id]
+            ]
+            for soil_id, lat, lon in zip(soil_ids, lats.tolist(), lons.tolist())
+        ]
+
+    def _create_profiles(self, avail_props, only_raw_data, windows=None, bbox=None):
+        """generate the stream items of all valid cells (in the windows and
+        lat/lon bbox, if given)"""
+        if len(avail_props) == 0:
+            return
+        grid, _ = self.grid_and_index
+        for rows, cols, lats, lons in self.iter_latlon_coords(windows=windows):
+            if bbox is not None:
+                min_lat, min_lon, max_lat, max_lon = bbox
+                inside = (
+                    (lats >= min_lat)
+                    & (lats <= max_lat)
+                    & (lons >= min_lon)
+                    & (lons <= max_lon)
+                )
+                rows, cols, lats, lons = (
+                    rows[inside],
+                    cols[inside],
+                    lats[inside],
+                    lons[inside],
+                )
+            for soil_id, lat, lon in zip(
+                grid[rows, cols].tolist(), lats.tolist(), lons.tolist()
+            ):
+                for id, profile_data in self.profile_datas(
+                    soil_id, avail_props, only_raw_data
+                ):
+                    yield id, profile_data, lat, lon
 
     async def streamAllProfiles_context(self, context):
         # streamAllProfiles @3 Query -> (allProfiles :Stream);
 
         ps = context.params
+        only_raw_data = ps.onlyRawData
         avail_props = self.available_properties(
-            ps.mandatory, ps.optional, ps.onlyRawData
+            ps.mandatory, ps.optional, only_raw_data
+        )
+        context.results.allProfiles = Stream(
+            self._create_profiles(avail_props, only_raw_data),
+            restorer=self.restorer,
+            prefetch=self._stream_prefetch,
+        )
+
+    def stream_profiles_in(
+        self, mandatory, optional, only_raw_data, bbox=None, row_col_ranges=None
+    ):
+        """Variant of streamAllProfiles restricted to a part of the soil grid, given either
+        by bbox, a lat/lon bounding box (min_lat, min_lon, max_lat, max_lon), or by
+        row_col_ranges, a list of (top, left, bottom, right) row/col ranges (inclusive).
+        Only the raster windows covering them are read, the cells of the bbox window
+        are then filtered to the ones with their center inside the bbox.
+        Returns the stream of the profiles of the cells."""
+        if (bbox is None) == (row_col_ranges is None):
+            raise ValueError("either bbox or row_col_ranges has to be given")
+        avail_props = self.available_properties(mandatory, optional, only_raw_data)
+        _, index = self.grid_and_index
+
+        windows = []
+        if bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            window = index.window_at(
+                *self._latlon_to_grid_crs.transform_bounds(
+                    min_lon, min_lat, max_lon, max_lat
+                )
+            )
+            if window is not None:
+                windows.append(window)
+        else:
+            nrows, ncols = self.grid_and_index[0].shape
+            for top, left, bottom, right in row_col_ranges:
+                top, left = max(top, 0), max(left, 0)
+                bottom, right = min(bottom, nrows - 1), min(right, ncols - 1)
+                if top <= bottom and left <= right:
+                    windows.append((top, bottom, left, right))
+
+        return Stream(
+            self._create_profiles(avail_props, only_raw_data, windows, bbox),
+            restorer=self.restorer,
+            prefetch=self._stream_prefetch,
         )
 
-        def create_profiles(lat, lon):
-            profiles = self.profiles_at(lat, lon, avail_props, ps.onlyRawData)
-            return profiles
+    @property
+    def distinct_soil_ids_and_cell_index(self):
+        """Return the distinct soil ids of the grid (sorted), the rows and cols of the first
+        cell (in row-major order) of every soil id and for every cell of the grid the index
+        into the distinct soil ids (-1 for nodata cells)."""
+        if self._distinct_soil_ids_and_cell_index is None:
+            grid, index = self.grid_and_index
+            rows, cols = index.valid_rows_cols
+            soil_ids, firsts, inverse = np.unique(
+                grid[rows, cols], return_index=True, return_inverse=True
+            )
+            cell_index = np.full(grid.shape, -1, dtype=np.int32)
+            cell_index[rows, cols] = inverse
+            self._distinct_soil_ids_and_cell_index = (
+                soil_ids,
+                (rows[firsts], cols[firsts]),
+                cell_index,
+            )
+        return self._distinct_soil_ids_and_cell_index
+
+    def stream_distinct_profiles(self, mandatory, optional, only_raw_data):
+        """Deduplicated variant of streamAllProfiles.
+        Instead of the profiles of every cell, the profiles of every distinct soil id are
+        streamed once (located at the first cell with that soil id). The profile ids start
+        with the soil id (profile group id).
+        Returns the stream and the cell index as dict with the packed row-major
+        little-endian data, its numpy dtype string, the shape (rows, cols), the nodata value
+        and the soil ids the index refers to."""
+        avail_props = self.available_properties(mandatory, optional, only_raw_data)
+        soil_ids, (rows, cols), cell_index = self.distinct_soil_ids_and_cell_index
 
-        profiles_gen = (
-            create_profiles(lat, lon) for lat, lon in self.all_latlon_coords
+        _, index = self.grid_and_index
+        lons, lats = self._grid_crs_to_latlon.transform(*index.cell_centers(rows, cols))
+
+        def create_profiles():
+            if len(avail_props) == 0:
+                return
+            for soil_id, lat, lon in zip(
+                soil_ids.tolist(), np.asarray(lats).tolist(), np.asarray(lons).tolist()
+            ):
+                for id, profile_data in self.profile_datas(
+                    soil_id, avail_props, only_raw_data
+                ):
+                    yield id, profile_data, lat, lon
+
+        dtype = cell_index.dtype.newbyteorder("<")
+        stream = Stream(
+            create_profiles(), restorer=self.restorer, prefetch=self._stream_prefetch
         )
-        context.results.allProfiles = Stream(profiles_gen)
+        return stream, {
+            "data": np.ascontiguousarray(cell_index, dtype=dtype).tobytes(),
+            "dtype": dtype.str,
+            "shape": cell_index.shape,
+            "nodata": -1,
+            "soil_ids": soil_ids.tolist(),
+        }
+
+
+def _put(items, item, cancelled):
+    """put item into the bounded items queue, waiting for space until cancelled"""
+    while not cancelled.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(stream_gen, items, cancelled):
+    """Put the items of stream_gen into the bounded items queue until it is exhausted
+    or the stream got cancelled, the end is marked by None.
+    If stream_gen fails, its exception ends the items instead and is raised again,
+    so it is reported by the thread as well."""
+    try:
+        for item in stream_gen:
+            if not _put(items, item, cancelled):
+                return
+    except Exception as e:
+        _put(items, e, cancelled)
+        raise
+    finally:
+        stream_gen.close()
+    _put(items, None, cancelled)
 
 
 class Stream(soil_capnp.Service.Stream.Server):
-    def __init__(self, stream_gen):
+    """Pages through the profiles created from the items of stream_gen, which are
+    (id, profile data, lat, lon) tuples.
+    If prefetch > 0, the generator is run on a worker thread which puts up to prefetch items
+    into a queue ahead of the requested pages, so the next page is prepared while the client
+    is still busy with the current one. The pages are awaited on a thread of the stream's
+    own executor. The worker stops when the stream capability is dropped.
+    If the generator fails, the page with the items produced before is returned and the
+    exception is raised for the next page."""
+
+    def __init__(self, stream_gen, restorer=None, prefetch=0):
         self._stream_gen = stream_gen
+        self._restorer = restorer
+        self._prefetch = prefetch
+        self._items = None
+        self._executor = None
+        self._cancelled = threading.Event()
+        self._done = False
+        self._error = None
 
-    async def nextProfiles(self, maxCount, **kwargs):
-        # nextProfiles @0 (maxCount :Int64 = 100) -> (profiles :List(Profile));
+    def __del__(self):
+        self._cancelled.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
 
-        ps = []
-        for _ in range(maxCount):
+    def _take(self, max_count):
+        """Block until max_count items are available, the generator is exhausted or
+        failed or the stream got cancelled. The exception the generator failed with is
+        raised right away only if there are no items to return."""
+        items = []
+        while len(items) < max_count and not self._cancelled.is_set():
             try:
-                ps.append(next(self._stream_gen))
-            except StopIteration:
+                item = self._items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                self._done = True
                 break
-        return ps
+            if isinstance(item, Exception):
+                self._done = True
+                self._error = item
+                if len(items) == 0:
+                    raise item
+                break
+            items.append(item)
+        return items
+
+    async def nextProfiles(self, maxCount, **kwargs):
+        # nextProfiles @0 (maxCount :Int64 = 100) -> (profiles :List(Profile));
+
+        if self._prefetch > 0:
+            if self._error is not None:
+                raise self._error
+            if self._items is None:
+                self._items = queue.Queue(maxsize=self._prefetch)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="stream_pages"
+                )
+                threading.Thread(
+                    target=_produce,
+                    args=(self._stream_gen, self._items, self._cancelled),
+                    daemon=True,
+                ).start()
+            items = (
+                []
+                if self._done
+                else await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._take, maxCount
+                )
+            )
+        else:
+            if self._error is not None:
+                raise self._error
+            items = []
+            for _ in range(maxCount):
+                try:
+                    items.append(next(self._stream_gen))
+                except StopIteration:
+                    break
+                except Exception as e:
+                    self._error = e
+                    if len(items) == 0:
+                        raise
+                    break
+
+        return [
+            Profile(profile_data, lat, lon, id=id, restorer=self._restorer)
+            for id, profile_data, lat, lon in items
+        ]
 
 
 async def main():
@@ -472,7 +1020,23 @@ async def main():
         name=cs.get("name"),
         description=cs.get("description"),
         restorer=restorer,
+        pool_size=cs.get("sqlite_pool_size", 4),
+        mmap_size=cs.get("sqlite_mmap_size", 256 * 1024 * 1024),
+        columnar_store=cs.get("columnar_store", False),
+        cache_max_entries=cs.get("cache_max_entries", 10000),
+        cache_max_bytes=cs.get("cache_max_bytes", 256 * 1024 * 1024),
+        profile_cache_max_entries=cs.get("profile_cache_max_entries", 10000),
+        profile_cache_max_bytes=cs.get("profile_cache_max_bytes", 256 * 1024 * 1024),
+        stream_prefetch=cs.get("stream_prefetch", 1000),
     )
+    # keep a reference to the task, so it won't be garbage collected while running
+    background_tasks = []
+    if cs.get("warm_up", False):
+        background_tasks.append(asyncio.create_task(service.warm_up()))
+    if cs.get("cache_stats_interval", 0) > 0:
+        background_tasks.append(
+            asyncio.create_task(service.log_cache_stats(cs["cache_stats_interval"]))
+        )
     await serv.init_and_run_service_from_config(
         config=config, service=service, restorer=restorer
     )
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+
+from zalfmas_services import sidecar_cache
+
+
+def cache_paths(path_to_sqlite_db):
+    """return the paths to the arrays and the json header of the warm cache next to the db"""
+    path_to_npz = str(path_to_sqlite_db) + ".warm.npz"
+    return path_to_npz, path_to_npz + ".json"
+
+
+def load_warm_cache(path_to_sqlite_db, path_to_ascii_grid, grid_crs):
+    """Load the warm cache of the soil service, if it is still valid for the database,
+    soil grid and crs. Returns a dict with the available parameters (params_raw,
+    params_derived) and the arrays (valid_rows, valid_cols, latlon) or None."""
+    path_to_npz, path_to_header = cache_paths(path_to_sqlite_db)
+    header = sidecar_cache.load_header(
+        path_to_header,
+        [path_to_sqlite_db, path_to_ascii_grid],
+        grid_crs=grid_crs.to_wkt(),
+    )
+    if header is None:
+        return None
+    try:
+        with np.load(path_to_npz) as arrays:
+            cache = {name: arrays[name] for name in arrays.files}
+    except (OSError, ValueError, KeyError):
+        return None
+    cache["params_raw"] = header["params_raw"]
+    cache["params_derived"] = header["params_derived"]
+    return cache
+
+
+def store_warm_cache(
+    path_to_sqlite_db,
+    path_to_ascii_grid,
+    grid_crs,
+    params_raw,
+    params_derived,
+    valid_rows,
+    valid_cols,
+    latlon,
+):
+    """Write the warm cache next to the sqlite database.
+    Returns True if the cache could be written."""
+    path_to_npz, path_to_header = cache_paths(path_to_sqlite_db)
+    try:
+        header = sidecar_cache.source_key(
+            [path_to_sqlite_db, path_to_ascii_grid],
+            grid_crs=grid_crs.to_wkt(),
+        )
+        header["params_raw"] = params_raw
+        header["params_derived"] = params_derived
+        sidecar_cache.remove_header(path_to_header)
+        sidecar_cache.write_file(
+            path_to_npz,
+            lambda _: np.savez(
+                _, valid_rows=valid_rows, valid_cols=valid_cols, latlon=latlon
+            ),
+        )
+        sidecar_cache.write_header(path_to_header, header)
+    except OSError as e:
+        print("Couldn't write warm cache for", path_to_sqlite_db, "due to", e)
+        return False
+    return True